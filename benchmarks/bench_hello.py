@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+请求分发基准测试 - 直接调用WSGI应用处理hello-world请求，统计每秒请求数
+
+用法: python benchmarks/bench_hello.py [次数] [其他版本的bottle_minimal.py ...]
+
+传入旧版本文件可以对比改动前后的结果，例如:
+    git show HEAD~1:bottle_minimal.py > /tmp/bottle_old.py
+    python benchmarks/bench_hello.py 100000 /tmp/bottle_old.py
+"""
+
+import sys
+import os
+import timeit
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_response(status, headers):
+    pass
+
+
+def requests_per_second(module, path, number):
+    app = module.Bottle()
+    app.route('/hello', callback=lambda: 'Hello World!')
+    app.route('/hello/<name>', callback=lambda name: 'Hello %s!' % name)
+    app.route('/missing/<name:int>', callback=lambda name: 'unreachable')
+
+    def run():
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': ''}
+        for chunk in app(environ, start_response):
+            pass
+    return number / min(timeit.repeat(run, number=number, repeat=3))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    modules = [('当前版本', load(os.path.join(ROOT, 'bottle_minimal.py'), 'bottle_current'))]
+    for i, path in enumerate(sys.argv[2:]):
+        modules.append((os.path.basename(path), load(path, 'bottle_other%d' % i)))
+
+    paths = [('静态路由', '/hello'), ('动态路由', '/hello/world'), ('404', '/missing/x')]
+    print('%-20s' % '版本' + ''.join('%14s' % label for label, _ in paths) + '   (请求/秒)')
+    for label, module in modules:
+        print('%-20s' % label + ''.join('%14.0f' % requests_per_second(module, path, number)
+                                        for _, path in paths))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+路由基准测试 - 注册大量动态路由的启动耗时，以及Router与TrieRouter的匹配开销
+
+用法: python benchmarks/bench_router.py [路由数量]
+"""
+
+import sys
+import os
+import re
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bottle_minimal import Router, TrieRouter, HTTPError
+
+EAGER_MAX = 2000
+
+
+class EagerRouter(Router):
+    """旧实现：每次add()都重新编译该方法的全部组合正则"""
+
+    def add(self, rule, method, target, name=None):
+        Router.add(self, rule, method, target, name)
+        if method in self.dyna_routes:
+            all_rules = self.dyna_routes[method]
+            comborules = self.dyna_regexes[method] = []
+            for x in range(0, len(all_rules), 99):
+                some = all_rules[x:x + 99]
+                combined = '|'.join('(^%s$)' % flatpat for (_, flatpat, _, _) in some)
+                comborules.append((re.compile(combined).match,
+                                   [(target, getargs) for (_, _, target, getargs) in some]))
+            self._dirty.discard(method)
+
+
+def rules(count):
+    for i in range(count):
+        yield '/api/resource%d/<id:int>/item%d/<name>' % (i, i)
+
+
+def register(router_class, count):
+    router = router_class()
+    start = time.perf_counter()
+    for i, rule in enumerate(rules(count)):
+        router.add(rule, 'GET', i)
+    # 第一次匹配会触发延迟编译，计入启动耗时
+    router.match({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/resource0/1/item0/x'})
+    return router, time.perf_counter() - start
+
+
+def lookup(router, path, number):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+
+    def run():
+        try:
+            router.match(environ)
+        except HTTPError:
+            pass
+    return min(timeit.repeat(run, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    routers = {}
+    # 旧实现是平方级的，只在较小的规模上运行
+    for size in sorted({min(count, EAGER_MAX), count}):
+        print('注册 %d 条动态路由:' % size)
+        for router_class in (EagerRouter, Router, TrieRouter):
+            if router_class is EagerRouter and size > EAGER_MAX:
+                continue
+            routers[router_class.__name__], elapsed = register(router_class, size)
+            print('  %-12s %8.3f s' % (router_class.__name__, elapsed))
+
+    last = count - 1
+    paths = [('首条路由', '/api/resource0/1/item0/x'),
+             ('末条路由', '/api/resource%d/1/item%d/x' % (last, last)),
+             ('未命中(404)', '/api/missing/1/item/x')]
+    print('\n单次匹配耗时 (us):')
+    for label, path in paths:
+        print('  %-10s Router %9.2f   TrieRouter %7.2f' % (
+            label, lookup(routers['Router'], path, 200),
+            lookup(routers['TrieRouter'], path, 200)))
+
+
+if __name__ == '__main__':
+    main()
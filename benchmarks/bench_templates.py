@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模板渲染基准测试 - 对比每次exec源码字符串与预编译函数的渲染开销
+
+用法: python benchmarks/bench_templates.py [次数]
+"""
+
+import sys
+import os
+import timeit
+import importlib.util
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bottle_minimal import SimpleTemplate
+
+# 直接复用 examples/templates.py 中的模板
+spec = importlib.util.spec_from_file_location(
+    'templates_example', os.path.join(ROOT, 'examples', 'templates.py'))
+example = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(example)
+
+USERS = [SimpleNamespace(name='User %d' % i, email='user%d@example.com' % i,
+                         age=20 + i % 40, active=i % 3 != 0) for i in range(50)]
+PRODUCTS = [SimpleNamespace(name='Product %d' % i, price=i * 1.5,
+                            category='Category %d' % (i % 5), stock=i) for i in range(50)]
+
+CASES = [
+    ('layout', example.layout_template, {'title': 'Home', 'content': '<p>Hello</p>'}),
+    ('user_list', example.user_list_template, {'users': USERS}),
+    ('product_list', example.product_list_template, {'products': PRODUCTS}),
+]
+
+
+def exec_source(tpl, kwargs):
+    # 旧实现: 每次渲染都exec翻译后的源码字符串
+    env = {'_stdout': []}
+    env.update(kwargs)
+    exec(tpl.code.replace('if len(_stdout) >= _flush: yield', 'pass'), env)
+    return ''.join(env['_stdout'])
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print('%-14s %14s %14s %14s %8s' % ('template', 'uncached us', 'exec src us',
+                                         'compiled us', 'speedup'))
+    for name, source, kwargs in CASES:
+        tpl = SimpleTemplate(source=source)
+        assert exec_source(tpl, kwargs) == tpl.render(**kwargs)
+        uncached = timeit.timeit(lambda: SimpleTemplate(source=source).render(**kwargs),
+                                 number=number) / number * 1e6
+        old = timeit.timeit(lambda: exec_source(tpl, kwargs), number=number) / number * 1e6
+        new = timeit.timeit(lambda: tpl.render(**kwargs), number=number) / number * 1e6
+        print('%-14s %14.1f %14.1f %14.1f %7.1fx' % (name, uncached, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,15 +8,37 @@ Only includes core routing, templates, static files, and basic WSGI server.
 import sys
 import os
 import re
+import ast
+import builtins
 import json
+import hashlib
+import gzip
+import zlib
+import time
+import stat
+import signal
+import socket
+import tempfile
+import traceback
+import queue
 import threading
+import asyncio
+import inspect
+import contextvars
 import mimetypes
 import email.utils
 from io import BytesIO
-from urllib.parse import urljoin, urlencode, quote as urlquote
+from collections import OrderedDict
+from itertools import chain
+from functools import update_wrapper
+from bisect import bisect_left
+from types import FunctionType, CoroutineType
+from urllib.parse import urljoin, urlencode, unquote, unquote_plus, quote as urlquote
+from concurrent.futures import ThreadPoolExecutor
+from http.client import responses as _http_responses
 from http.cookies import SimpleCookie
 from collections.abc import MutableMapping as DictMixin
-from wsgiref.simple_server import make_server
+from wsgiref.simple_server import make_server, ServerHandler, WSGIRequestHandler, WSGIServer
 
 __version__ = '0.1-minimal'
 
@@ -42,6 +64,112 @@ def makelist(data):
         return [data]
     return []
 
+# Computed on first access, then stored on the instance; delete the attribute
+# to have it computed again
+class cached_property:
+    def __init__(self, func):
+        self.__doc__ = func.__doc__
+        self.func = func
+
+    def __get__(self, obj, cls):
+        if obj is None: return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+# Thread-safe mapping that drops the least recently used keys beyond maxsize.
+# With a ttl (seconds), entries also expire that long after they were set.
+# With maxbytes, entries are also dropped while the summed sizeof() of all
+# values is larger than that.
+class LRUCache:
+    def __init__(self, maxsize=128, ttl=None, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires, size = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.size -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old: self.size -= old[2]
+            self._data[key] = (value, expires, size)
+            self.size += size
+            while len(self._data) > self.maxsize or \
+                    (self.maxbytes is not None and self.size > self.maxbytes):
+                self.size -= self._data.popitem(last=False)[1][2]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value, _, size = self._data.pop(key, (default, None, 0))
+            self.size -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self):
+        return len(self._data)
+
+# Iterator wrapper that keeps the close() of the object it was built from
+class _closeiter:
+    def __init__(self, iterator, close=None):
+        self.iterator = iterator
+        self.close_callbacks = makelist(close)
+
+    def __iter__(self):
+        return iter(self.iterator)
+
+    def close(self):
+        for func in self.close_callbacks:
+            func()
+
+# Iterates over a file-like object in blocks; also the wsgi.file_wrapper of
+# the built-in server
+class WSGIFileWrapper:
+    buffer_size = 64 * 1024
+
+    def __init__(self, fp, buffer_size=None):
+        self.fp = fp
+        self.buffer_size = buffer_size or self.buffer_size
+        for attr in ('fileno', 'close', 'read', 'readlines', 'tell', 'seek'):
+            if hasattr(fp, attr):
+                setattr(self, attr, getattr(fp, attr))
+
+    def __iter__(self):
+        buff, read = self.buffer_size, self.read
+        part = read(buff)
+        while part:
+            yield part
+            part = read(buff)
+
 # Exceptions
 class BottleException(Exception):
     pass
@@ -66,12 +194,46 @@ def _re_flatten(p):
     return re.sub(r'(\\*)(\(\?P<[^>]+>|\((?!\?))', lambda m: m.group(0) if
                   len(m.group(1)) % 2 else m.group(1) + '(?:', p)
 
+# Turn a route's builder list into a generated function that pops its
+# arguments from the given dict and fills a single %-format string
+def _url_builder(builder):
+    fmt, args, env = [], [], {}
+    for key, out_filter in builder:
+        if not key:
+            fmt.append(out_filter.replace('%', '%%'))
+            continue
+        fmt.append('%s')
+        if out_filter is str:
+            args.append('pop(%r)' % key)
+        else:
+            env['f%d' % len(args)] = out_filter
+            args.append('f%d(pop(%r))' % (len(args), key))
+    fmt = ''.join(fmt)
+    if not args:
+        url = fmt % ()
+        return lambda query: url
+    source = 'def make_url(query):\n    pop = query.pop\n    return %r %% (%s,)\n'
+    exec(compile(source % (fmt, ', '.join(args)), '<url builder>', 'exec'), env)
+    return env['make_url']
+
 class Router:
-    def __init__(self):
+    def __init__(self, cache_size=0):
         self.static = {}
         self.dyna_routes = {}
         self.dyna_regexes = {}
         self.builder = {}
+        self.url_builders = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        # Optional (verb, path) -> (target, args) cache for dynamic matches
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self._generation = 0
+        # path -> methods for static rules, and distinct dynamic patterns in
+        # registration order, used to build 405 Allow headers and OPTIONS
+        self.static_methods = {}
+        self.dyna_methods = OrderedDict()
+        self._allow_regexes = []
+        self._allow_count = 0
         self.filters = {
             're': lambda conf: (_re_flatten(conf or '[^/]+'), None, None),
             'int': lambda conf: (r'-?\d+', int, lambda x: str(int(x))),
@@ -102,6 +264,9 @@ class Router:
             yield prefix + rule[offset:], None, None
 
     def add(self, rule, method, target, name=None):
+        if self.cache is not None:
+            self._generation += 1
+            self.cache.clear()
         anons = 0
         keys = []
         pattern = ''
@@ -128,10 +293,14 @@ class Router:
                 builder.append((None, key))
 
         self.builder[rule] = builder
-        if name: self.builder[name] = builder
+        self.url_builders[rule] = _url_builder(builder)
+        if name:
+            self.builder[name] = builder
+            self.url_builders[name] = self.url_builders[rule]
 
         if is_static:
             self.static.setdefault(method, {})[rule] = (target, None)
+            self.static_methods.setdefault(rule, set()).add(method)
             return
 
         try:
@@ -159,56 +328,376 @@ class Router:
         whole_rule = (rule, flatpat, target, getargs)
 
         self.dyna_routes.setdefault(method, []).append(whole_rule)
-        self._compile(method)
+        self.dyna_methods.setdefault(flatpat, set()).add(method)
+        # Compiled lazily on the next match, so adding n routes stays linear
+        self._dirty.add(method)
+
+    def _compile_dirty(self):
+        with self._lock:
+            for method in list(self._dirty):
+                self._compile(method)
+                self._dirty.discard(method)
 
     def _compile(self, method):
+        # Full chunks are kept, only the trailing partial chunk is rebuilt
         all_rules = self.dyna_routes[method]
-        comborules = self.dyna_regexes[method] = []
+        comborules = list(self.dyna_regexes.get(method, ()))
         maxgroups = 99
-        for x in range(0, len(all_rules), maxgroups):
+        if comborules and len(comborules[-1][1]) < maxgroups:
+            comborules.pop()
+        for x in range(len(comborules) * maxgroups, len(all_rules), maxgroups):
             some = all_rules[x:x + maxgroups]
             combined = (flatpat for (_, flatpat, _, _) in some)
             combined = '|'.join('(^%s$)' % flatpat for flatpat in combined)
             combined = re.compile(combined).match
             rules = [(target, getargs) for (_, _, target, getargs) in some]
             comborules.append((combined, rules))
+        self.dyna_regexes[method] = comborules
 
     def match(self, environ):
+        if self._dirty: self._compile_dirty()
         verb = environ['REQUEST_METHOD'].upper()
         path = environ['PATH_INFO'] or '/'
 
         methods = ('HEAD', 'GET', 'ANY') if verb == 'HEAD' else (verb, 'ANY')
 
+        # Static routes are a plain dict lookup; the cache only serves the
+        # dynamic branch and is consulted once, on the first dynamic method
+        cache, lookup = self.cache, self.cache
         for method in methods:
             if method in self.static and path in self.static[method]:
                 target, getargs = self.static[method][path]
                 return target, getargs(path) if getargs else {}
-            elif method in self.dyna_regexes:
-                for combined, rules in self.dyna_regexes[method]:
-                    match = combined(path)
-                    if match:
-                        target, getargs = rules[match.lastindex - 1]
-                        return target, getargs(path) if getargs else {}
-
+            elif method in self.dyna_routes:
+                if lookup is not None:
+                    hit = lookup.get((verb, path))
+                    if hit:
+                        return hit[0], dict(hit[1])
+                    lookup, generation = None, self._generation
+                hit = self._match_dynamic(method, path)
+                if hit:
+                    target, getargs = hit
+                    args = getargs(path) if getargs else {}
+                    if cache is not None and generation == self._generation:
+                        cache.set((verb, path), (target, dict(args)))
+                    return target, args
+
+        allowed = self.allowed_methods(path)
+        if allowed:
+            if 'GET' in allowed: allowed.add('HEAD')
+            allow = ', '.join(sorted(allowed | {'OPTIONS'}))
+            if verb == 'OPTIONS':
+                raise HTTPResponse(status=200, Allow=allow)
+            raise HTTPError(405, "Method not allowed.", Allow=allow)
         raise HTTPError(404, "Not found: " + repr(path))
 
+    def allowed_methods(self, path):
+        # Methods registered for any rule matching `path`. Every distinct
+        # dynamic pattern is tested in a single pass per chunk: each one sits
+        # in an empty-or-lookahead alternative, so all matching groups are set.
+        allowed = set(self.static_methods.get(path, ()))
+        if self._allow_count < len(self.dyna_methods):
+            self._compile_allowed()
+        for combined, methods in self._allow_regexes:
+            for group, found in enumerate(combined(path).groups()):
+                if found is not None:
+                    allowed |= methods[group]
+        allowed.discard('ANY')
+        return allowed
+
+    def _compile_allowed(self):
+        with self._lock:
+            patterns = list(self.dyna_methods.items())
+            comborules = list(self._allow_regexes)
+            maxgroups = 99
+            if comborules and len(comborules[-1][1]) < maxgroups:
+                comborules.pop()
+            for x in range(len(comborules) * maxgroups, len(patterns), maxgroups):
+                some = patterns[x:x + maxgroups]
+                combined = ''.join('(?:(?=(%s$))|)' % flatpat for flatpat, _ in some)
+                combined = re.compile('^' + combined).match
+                comborules.append((combined, [methods for _, methods in some]))
+            self._allow_regexes = comborules
+            self._allow_count = len(patterns)
+
+    def _match_dynamic(self, method, path):
+        for combined, rules in self.dyna_regexes[method]:
+            match = combined(path)
+            if match:
+                return rules[match.lastindex - 1]
+        return None
+
     def build(self, _name, *anons, **query):
-        builder = self.builder.get(_name)
-        if not builder:
+        make_url = self.url_builders.get(_name)
+        if not make_url:
             raise ValueError("No route with that name: %s" % _name)
-        try:
+        if anons:
             for i, value in enumerate(anons):
                 query['anon%d' % i] = value
-            url = ''.join([f(query.pop(n)) if n else f for (n, f) in builder])
-            return url if not query else url + '?' + urlencode(query, doseq=True)
+        try:
+            url = make_url(query)
         except KeyError as E:
             raise ValueError('Missing URL argument: %r' % E.args[0])
+        return url if not query else url + '?' + urlencode(query, doseq=True)
+
+# Router backend that indexes dynamic rules by the literal path segments in
+# front of their first wildcard. A match only tries the rules stored along the
+# request path, so its cost follows the path depth rather than the number of
+# routes. Results are the same as Router's: the first added rule wins.
+class TrieRouter(Router):
+    def __init__(self, cache_size=0):
+        Router.__init__(self, cache_size)
+        self.trie = {}
+        self._indexed = {}
+
+    def _compile(self, method):
+        # Nodes are (children by segment, [(index, match, target, getargs)])
+        rules = self.dyna_routes[method]
+        root = self.trie.setdefault(method, ({}, []))
+        for index in range(self._indexed.get(method, 0), len(rules)):
+            rule, flatpat, target, getargs = rules[index]
+            prefix, mode, _ = next(self._itertokens(rule))
+            node = root
+            for segment in ('' if mode else prefix).split('/')[:-1]:
+                node = node[0].setdefault(segment, ({}, []))
+            node[1].append((index, re.compile('^%s$' % flatpat).match, target, getargs))
+        self._indexed[method] = len(rules)
+
+    def _match_dynamic(self, method, path):
+        node = self.trie[method]
+        best = None
+        segments = iter(path.split('/')[:-1])
+        while node is not None:
+            for index, match, target, getargs in node[1]:
+                if best is not None and index > best[0]:
+                    break
+                if match(path):
+                    best = index, target, getargs
+                    break
+            node = node[0].get(next(segments, None))
+        return best[1:] if best else None
+
+# Multi-value dicts: item access returns the newest value, getall() every one
+class MultiDict(DictMixin):
+    def __init__(self, *a, **k):
+        self.dict = dict((k, [v]) for (k, v) in dict(*a, **k).items())
+
+    def __len__(self): return len(self.dict)
+    def __iter__(self): return iter(self.dict)
+    def __contains__(self, key): return key in self.dict
+    def __delitem__(self, key): del self.dict[key]
+    def __getitem__(self, key): return self.dict[key][-1]
+    def __setitem__(self, key, value): self.append(key, value)
+
+    def get(self, key, default=None, index=-1, type=None):
+        try:
+            val = self.dict[key][index]
+            return type(val) if type else val
+        except Exception:
+            pass
+        return default
+
+    def append(self, key, value):
+        self.dict.setdefault(key, []).append(value)
+
+    def replace(self, key, value):
+        self.dict[key] = [value]
+
+    def getall(self, key):
+        return self.dict.get(key) or []
+
+    def allitems(self):
+        return ((k, v) for k, vl in self.dict.items() for v in vl)
+
+# MultiDict for decoded query and form data; missing attributes are ''
+class FormsDict(MultiDict):
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return self.get(name, '')
+
+def _parse_qsl(qs):
+    r = []
+    for pair in qs.split('&'):
+        if not pair: continue
+        nv = pair.split('=', 1)
+        if len(nv) != 2: nv.append('')
+        r.append((unquote_plus(nv[0]), unquote_plus(nv[1])))
+    return r
+
+# Read once at import: os.umask() can only be queried by setting it, which
+# would briefly affect files created by other threads
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+# Uploaded file from a multipart/form-data request. Parts larger than the
+# memory limit are spooled to a named temporary file that save() can move
+# into place with os.replace() instead of copying.
+class FileUpload:
+    def __init__(self, fileobj, name, filename, headers=None, tempname=None):
+        self.file = fileobj
+        self.name = name
+        self.raw_filename = filename
+        self.headers = headers or {}
+        self._tempname = tempname
+
+    @property
+    def content_type(self):
+        return self.headers.get('Content-Type', '')
+
+    @property
+    def content_length(self):
+        pos = self.file.tell()
+        size = self.file.seek(0, os.SEEK_END)
+        self.file.seek(pos)
+        return size
+
+    @property
+    def filename(self):
+        # Basename without path separators or unsafe characters
+        name = os.path.basename(self.raw_filename.replace('\\', '/'))
+        name = re.sub(r'[^\w.-]+', '-', name).strip('.-')
+        return name[:255] or 'empty'
+
+    def save(self, destination, overwrite=False, chunk_size=65536):
+        if not isinstance(destination, str):
+            self.file.seek(0)
+            for chunk in iter(lambda: self.file.read(chunk_size), b''):
+                destination.write(chunk)
+            return
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, self.filename)
+        if not overwrite and os.path.exists(destination):
+            raise IOError('File exists.')
+        if self._tempname:
+            self.file.close()
+            try:
+                # mkstemp() creates 0600 files; match what open() would create
+                os.chmod(self._tempname, 0o666 & ~_UMASK)
+                os.replace(self._tempname, destination)
+            except OSError:
+                # Different file system: fall back to copying
+                self.file = open(self._tempname, 'rb')
+            else:
+                # Keep a readable handle so the upload can be saved again
+                self._tempname = None
+                self.file = open(destination, 'rb')
+                return
+        with open(destination, 'wb') as fp:
+            self.save(fp, chunk_size=chunk_size)
+
+    def close(self):
+        self.file.close()
+        if self._tempname:
+            try:
+                os.unlink(self._tempname)
+            except OSError:
+                pass
+            self._tempname = None
+
+    def __del__(self):
+        self.close()
+
+_option_re = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:\\.|[^"])*"|[^;]*)')
+
+def _parse_options_header(header):
+    # 'form-data; name="a"; filename="b"' -> ('form-data', {'name': 'a', ...})
+    value, _, rest = header.partition(';')
+    options = {}
+    for key, val in _option_re.findall(';' + rest):
+        if val[:1] == '"':
+            val = val[1:-1].replace('\\"', '"')
+        options[key.lower()] = val
+    return value.strip().lower(), options
+
+def _iter_multipart(chunks, boundary, memfile_max, header_max=8192):
+    # Incremental multipart/form-data parser. Yields (headers, options, file,
+    # tempname) per part while holding at most one chunk plus a boundary in
+    # memory; file parts above memfile_max are written to a temporary file.
+    delimiter = b'\r\n--' + boundary
+    keep = len(delimiter) - 1
+    buf = b'\r\n'
+    state = 'preamble'
+    part = tempname = None
+    try:
+        for chunk in chain(chunks, [None]):
+            if chunk is None:
+                raise HTTPError(400, 'Unexpected end of multipart body.')
+            buf += chunk
+            while True:
+                if state in ('preamble', 'body'):
+                    i = buf.find(delimiter)
+                    end = i if i >= 0 else max(len(buf) - keep, 0)
+                    if state == 'body' and end:
+                        size += end
+                        if tempname is None and size > memfile_max:
+                            if 'filename' not in options:
+                                raise HTTPError(413, 'Form field too large.')
+                            fd, tempname = tempfile.mkstemp(prefix='bottle-upload-')
+                            spooled, part = part, os.fdopen(fd, 'w+b')
+                            part.write(spooled.getvalue())
+                        part.write(buf[:end])
+                    if i < 0:
+                        buf = buf[end:]
+                        break
+                    buf = buf[i + len(delimiter):]
+                    if state == 'body':
+                        part.seek(0)
+                        done, part, tempname = (part, tempname), None, None
+                        yield (headers, options) + done
+                    state = 'boundary'
+                if state == 'boundary':
+                    if buf[:2] == b'--':
+                        return
+                    i = buf.find(b'\r\n')
+                    if i < 0:
+                        if len(buf) > header_max:
+                            raise HTTPError(400, 'Invalid multipart boundary.')
+                        break
+                    buf = buf[i + 2:]
+                    state = 'headers'
+                if state == 'headers':
+                    if buf[:2] == b'\r\n':
+                        head, buf = b'', buf[2:]
+                    else:
+                        i = buf.find(b'\r\n\r\n')
+                        if i < 0:
+                            if len(buf) > header_max:
+                                raise HTTPError(400, 'Multipart headers too large.')
+                            break
+                        head, buf = buf[:i], buf[i + 4:]
+                    headers = {}
+                    for line in head.decode('utf8', 'replace').split('\r\n') if head else ():
+                        name, sep, value = line.partition(':')
+                        if not sep:
+                            raise HTTPError(400, 'Invalid multipart header.')
+                        headers[name.strip().title()] = value.strip()
+                    disposition, options = _parse_options_header(headers.get('Content-Disposition', ''))
+                    if disposition != 'form-data' or 'name' not in options:
+                        raise HTTPError(400, 'Invalid Content-Disposition in multipart part.')
+                    part, size = BytesIO(), 0
+                    state = 'body'
+    finally:
+        # Remove the spooled file of a part that was never handed out
+        if tempname is not None:
+            part.close()
+            os.unlink(tempname)
 
 # Request and Response
 class Request:
+    # Bodies larger than MEMFILE_MAX are buffered in a temporary file instead
+    # of memory; bodies larger than MAX_BODY_SIZE (if set) are answered with 413
+    MEMFILE_MAX = 102400
+    MAX_BODY_SIZE = None
+
+    __slots__ = ('environ', 'route', '_body', '_json', '_query', '_forms', '_params', '_files')
+
     def __init__(self, environ):
         self.environ = environ
+        self.route = None
         self._body = None
+        self._json = None
+        self._query = self._forms = self._params = self._files = None
 
     @property
     def path(self):
@@ -218,52 +707,122 @@ class Request:
     def method(self):
         return self.environ.get('REQUEST_METHOD', 'GET').upper()
 
+    # query, forms and params are parsed once per request and cached
     @property
     def query(self):
-        get = {}
-        pairs = self.environ.get('QUERY_STRING', '').split('&')
-        for pair in pairs:
-            if not pair: continue
-            nv = pair.split('=', 1)
-            if len(nv) != 2: nv.append('')
-            get[nv[0]] = nv[1]
-        return get
+        if self._query is None:
+            self._query = FormsDict()
+            for key, value in _parse_qsl(self.environ.get('QUERY_STRING', '')):
+                self._query.append(key, value)
+        return self._query
 
     @property
     def forms(self):
-        forms = {}
-        if self.method in ('POST', 'PUT'):
-            content_type = self.environ.get('CONTENT_TYPE', '')
-            if content_type.startswith('application/x-www-form-urlencoded'):
-                body = self.body.read().decode('utf8')
-                for pair in body.split('&'):
-                    if not pair: continue
-                    nv = pair.split('=', 1)
-                    if len(nv) != 2: nv.append('')
-                    forms[nv[0]] = nv[1]
-        return forms
+        if self._forms is None:
+            self._forms, self._files = FormsDict(), FormsDict()
+            if self.method in ('POST', 'PUT'):
+                content_type = self.environ.get('CONTENT_TYPE', '')
+                if content_type.startswith('application/x-www-form-urlencoded'):
+                    body = self.body.read().decode('utf8', 'replace')
+                    for key, value in _parse_qsl(body):
+                        self._forms.append(key, value)
+                elif content_type.startswith('multipart/form-data'):
+                    self._parse_multipart(content_type)
+        return self._forms
+
+    @property
+    def files(self):
+        if self._files is None:
+            self.forms
+        return self._files
+
+    def _parse_multipart(self, content_type):
+        boundary = _parse_options_header(content_type)[1].get('boundary')
+        if not boundary or len(boundary) > 200:
+            raise HTTPError(400, 'Invalid multipart boundary.')
+        parts = _iter_multipart(self.iter_body(65536), boundary.encode('latin1'),
+                                self.MEMFILE_MAX)
+        for headers, options, part, tempname in parts:
+            if 'filename' in options:
+                upload = FileUpload(part, options['name'], options['filename'], headers, tempname)
+                self._files.append(options['name'], upload)
+            else:
+                charset = _parse_options_header(headers.get('Content-Type', ''))[1].get('charset')
+                self._forms.append(options['name'], part.read().decode(charset or 'utf8', 'replace'))
 
     @property
     def params(self):
-        params = {}
-        params.update(self.query)
-        params.update(self.forms)
-        return params
+        # Form values are added last, so they win over query values
+        if self._params is None:
+            self._params = FormsDict()
+            for key, value in chain(self.query.allitems(), self.forms.allitems()):
+                self._params.append(key, value)
+        return self._params
+
+    @property
+    def json(self):
+        # Parsed application/json body (cached), or None for other requests
+        if self._json is None:
+            self._json = (self._parse_json(),)
+        return self._json[0]
+
+    def _parse_json(self):
+        content_type = self.environ.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+        if content_type != 'application/json' and not content_type.endswith('+json'):
+            return None
+        if self.content_length > self.MEMFILE_MAX:
+            raise HTTPError(413, 'JSON body too large.')
+        body = self.body.read()
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise HTTPError(400, 'Invalid JSON.')
+
+    @property
+    def content_length(self):
+        try:
+            return max(int(self.environ.get('CONTENT_LENGTH') or 0), 0)
+        except ValueError:
+            return 0
+
+    def _limit_body(self):
+        if self.MAX_BODY_SIZE is not None and self.content_length > self.MAX_BODY_SIZE:
+            raise HTTPError(413, 'Request entity too large.')
+
+    def iter_body(self, chunk_size=8192):
+        # Stream at most Content-Length bytes from wsgi.input. Once the body
+        # has been buffered, the chunks come from the buffer instead.
+        if self._body is not None:
+            body = self.body
+            return iter(lambda: body.read(chunk_size), b'')
+        self._body = False
+        return self._iter_input(chunk_size)
+
+    def _iter_input(self, chunk_size):
+        self._limit_body()
+        remaining = self.content_length
+        read = self.environ['wsgi.input'].read if remaining else None
+        while remaining:
+            chunk = read(min(chunk_size, remaining))
+            if not chunk:
+                raise HTTPError(400, 'Error while reading request body.')
+            remaining -= len(chunk)
+            yield chunk
 
     @property
     def body(self):
         if self._body is None:
-            try:
-                read_func = self.environ['wsgi.input'].read
-            except KeyError:
-                self._body = BytesIO()
-                return self._body
-            self._body = BytesIO()
-            while True:
-                chunk = read_func(8192)
-                if not chunk: break
-                self._body.write(chunk)
-            self._body.seek(0)
+            if self.content_length > self.MEMFILE_MAX:
+                body = tempfile.TemporaryFile()
+            else:
+                body = BytesIO()
+            for chunk in self._iter_input(8192):
+                body.write(chunk)
+            self._body = body
+        elif self._body is False:
+            raise RuntimeError('Request body was already consumed by iter_body().')
         self._body.seek(0)
         return self._body
 
@@ -274,6 +833,8 @@ class Request:
         return self.environ.get(key, default)
 
 class Response:
+    __slots__ = ('status', 'headers', 'body')
+
     def __init__(self):
         self.status = 200
         self.headers = {}
@@ -285,40 +846,298 @@ class Response:
     def get_header(self, name, default=None):
         return self.headers.get(name, default)
 
-# Thread-local request and response
-_local = threading.local()
+# Precomputed WSGI status lines ('404 Not Found'), indexed by status code
+_HTTP_STATUS_LINES = dict((code, '%d %s' % (code, reason))
+                          for code, reason in _http_responses.items())
+
+# Request and response of the current request. Context variables are local
+# to each thread like threading.local, and also to each asyncio task.
+_request_var = contextvars.ContextVar('bottle.request', default=None)
+_response_var = contextvars.ContextVar('bottle.response', default=None)
 
 def request():
-    return getattr(_local, 'request', None)
+    return _request_var.get()
 
 def response():
-    return getattr(_local, 'response', None)
+    return _response_var.get()
+
+# Response compression
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'application/xhtml+xml', 'image/svg+xml')
+
+def _compressible(content_type):
+    ctype = content_type.split(';')[0].strip().lower()
+    return ctype.startswith(COMPRESSIBLE_TYPES) or ctype.endswith(('+json', '+xml'))
+
+def _iter_gzip(chunks, level):
+    # Each chunk is flushed on its own so streamed responses stay streamed
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _set_gzip_headers(headers):
+    # The encoded body differs byte for byte from the identity one: its ETag
+    # can only be weak, and byte ranges of it are not served
+    headers['Content-Encoding'] = 'gzip'
+    headers.pop('Accept-Ranges', None)
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = 'W/' + etag
+
+# A route with its plugins. `call` is the callback wrapped by every plugin that
+# applies to it; it is built on first use and cached until the app is reset.
+class Route:
+    def __init__(self, app, rule, method, callback, name=None, plugins=None, skiplist=None, **config):
+        self.app = app
+        self.rule = rule
+        self.method = method
+        self.callback = callback
+        self.name = name
+        self.plugins = plugins or []
+        self.skiplist = skiplist or []
+        self.config = config
+
+    @cached_property
+    def call(self):
+        return self._make_callback()
+
+    def reset(self):
+        self.__dict__.pop('call', None)
+
+    def all_plugins(self):
+        # Route plugins apply before app plugins; later ones with the same name
+        # and anything in the skiplist (instance, class or name) are left out
+        unique = set()
+        for p in reversed(self.app.plugins + self.plugins):
+            if True in self.skiplist: break
+            name = getattr(p, 'name', False)
+            if name and (name in self.skiplist or name in unique): continue
+            if p in self.skiplist or type(p) in self.skiplist: continue
+            if name: unique.add(name)
+            yield p
+
+    def _make_callback(self):
+        callback = self.callback
+        for plugin in self.all_plugins():
+            if hasattr(plugin, 'apply'):
+                callback = plugin.apply(callback, self)
+            else:
+                callback = plugin(callback)
+            if callback is not self.callback:
+                update_wrapper(callback, self.callback)
+        return callback
+
+    def __repr__(self):
+        return '<%s %s -> %s>' % (self.method, self.rule, getattr(self.callback, '__name__', '?'))
+
+# Methods recorded by name when no specific route matched them; the rest are
+# counted as OTHER
+_METRICS_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS'))
+
+# Per-route request counts, status counts and latency histograms of the
+# match, callback and cast phases. Every thread writes to its own shard, so
+# recording takes no lock; snapshot() merges the shards.
+class Metrics:
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            # (requests, statuses, histograms) written only by this thread
+            shard = self._local.shard = ({}, {}, {})
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def record(self, method, rule, status):
+        requests, statuses, _ = self._shard()
+        key = (method, rule)
+        requests[key] = requests.get(key, 0) + 1
+        key = (rule, status)
+        statuses[key] = statuses.get(key, 0) + 1
+
+    def observe(self, phase, rule, seconds):
+        histograms = self._shard()[2]
+        key = (phase, rule)
+        hist = histograms.get(key)
+        if hist is None:
+            hist = histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        hist[0][bisect_left(self.buckets, seconds)] += 1
+        hist[1] += seconds
+
+    def snapshot(self):
+        # {'requests': {(method, rule): n}, 'statuses': {(rule, status): n},
+        #  'latency': {(phase, rule): {'buckets': [(le, n)], 'sum': s, 'count': n}}}
+        requests, statuses, latency = {}, {}, {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard_requests, shard_statuses, shard_histograms in shards:
+            for key, n in dict(shard_requests).items():
+                requests[key] = requests.get(key, 0) + n
+            for key, n in dict(shard_statuses).items():
+                statuses[key] = statuses.get(key, 0) + n
+            for key, (counts, total) in dict(shard_histograms).items():
+                merged = latency.setdefault(key, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], list(counts))]
+                merged[1] += total
+        for key, (counts, total) in latency.items():
+            cumulative, buckets = 0, []
+            for le, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                buckets.append((le, cumulative))
+            latency[key] = {'buckets': buckets, 'sum': total, 'count': cumulative}
+        return {'requests': requests, 'statuses': statuses, 'latency': latency}
+
+    def prometheus(self):
+        def labels(**kw):
+            return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')
+                                                  .replace('\n', '\\n')) for k, v in kw.items())
+        snap = self.snapshot()
+        lines = ['# HELP bottle_requests_total Requests handled, by method and route rule.',
+                 '# TYPE bottle_requests_total counter']
+        for (method, rule), n in sorted(snap['requests'].items()):
+            lines.append('bottle_requests_total{%s} %d' % (labels(method=method, rule=rule), n))
+        lines += ['# HELP bottle_responses_total Responses sent, by route rule and status code.',
+                  '# TYPE bottle_responses_total counter']
+        for (rule, status), n in sorted(snap['statuses'].items()):
+            lines.append('bottle_responses_total{%s} %d' % (labels(rule=rule, status=status), n))
+        lines += ['# HELP bottle_phase_seconds Time spent in the match, callback and cast phases.',
+                  '# TYPE bottle_phase_seconds histogram']
+        for (phase, rule), hist in sorted(snap['latency'].items()):
+            for le, n in hist['buckets']:
+                le = '+Inf' if le == float('inf') else repr(float(le))
+                lines.append('bottle_phase_seconds_bucket{%s} %d' % (labels(phase=phase, rule=rule, le=le), n))
+            lines.append('bottle_phase_seconds_sum{%s} %r' % (labels(phase=phase, rule=rule), hist['sum']))
+            lines.append('bottle_phase_seconds_count{%s} %d' % (labels(phase=phase, rule=rule), hist['count']))
+        return '\n'.join(lines) + '\n'
+
+    def endpoint(self):
+        # Route callback: app.route('/metrics', callback=app.metrics.endpoint)
+        return HTTPResponse(self.prometheus(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+# Request headers that make a request unsuitable for coalescing
+_COALESCE_HEADERS = frozenset(('HTTP_COOKIE', 'HTTP_AUTHORIZATION', 'HTTP_IF_NONE_MATCH',
+                               'HTTP_IF_MODIFIED_SINCE', 'HTTP_RANGE', 'HTTP_IF_RANGE'))
+
+def _vary_safe(headers):
+    # True if the response varies on no request header except Accept-Encoding,
+    # which compression handles per request after the result is shared
+    vary = headers.get('Vary')
+    return not vary or all(v.strip().lower() in ('', 'accept-encoding') for v in vary.split(','))
+
+# In-flight computation shared by coalesced requests
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = self.error = None
 
 # Application
 class Bottle:
-    def __init__(self):
+    def __init__(self, router=None, compress=False, compress_level=6, compress_min_size=1024,
+                 autojson=True, json_dumps=None, json_stream_items=1000,
+                 single_flight=False, single_flight_timeout=30, metrics=None):
         self.routes = []
-        self.router = Router()
+        self.router = router or Router()
         self.error_handler = {}
-
-    def route(self, path=None, method='GET', callback=None, name=None):
+        self.plugins = []
+        self._hooks = {'before_request': [], 'after_request': []}
+        # dict (and non-text list) results are encoded with json_dumps, which
+        # may return str or bytes; longer lists are encoded item by item
+        self.autojson = autojson
+        self.json_dumps = json_dumps or json.dumps
+        self.json_stream_items = json_stream_items
+        # Opt-in gzip compression of dynamic responses
+        self.compress = compress
+        self.compress_level = compress_level
+        self.compress_min_size = compress_min_size
+        # Opt-in request coalescing: concurrent identical GET/HEAD requests
+        # wait for one computation of the route and share its encoded result
+        self.single_flight = single_flight
+        self.single_flight_timeout = single_flight_timeout
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        # Optional instrumentation (a Metrics instance, or True for a new one)
+        self.metrics = Metrics() if metrics is True else metrics or None
+
+    def route(self, path=None, method='GET', callback=None, name=None,
+              apply=None, skip=None, **config):
         if callable(path): path, callback = None, path
+        plugins = makelist(apply)
+        skiplist = makelist(skip)
         
         def decorator(callback):
             for rule in makelist(path) or ['/' + callback.__name__]:
                 for verb in makelist(method):
-                    self.routes.append((rule, verb.upper(), callback, name))
-                    self.router.add(rule, verb.upper(), callback, name)
+                    route = Route(self, rule, verb.upper(), callback, name,
+                                  plugins, skiplist, **config)
+                    self.routes.append(route)
+                    self.router.add(rule, verb.upper(), route, name)
             return callback
         
         return decorator(callback) if callback else decorator
 
+    def install(self, plugin):
+        # A plugin is a decorator-like callable, or an object with
+        # apply(callback, route) and optional name, setup(app) and close()
+        if hasattr(plugin, 'setup'): plugin.setup(self)
+        if not callable(plugin) and not hasattr(plugin, 'apply'):
+            raise TypeError("Plugins must be callable or implement .apply()")
+        self.plugins.append(plugin)
+        self.reset()
+        return plugin
+
+    def uninstall(self, plugin):
+        # Remove by instance, class or name; True removes every plugin
+        removed = []
+        for i, p in list(enumerate(self.plugins))[::-1]:
+            if plugin is True or plugin is p or plugin is type(p) \
+                    or getattr(p, 'name', True) == plugin:
+                removed.append(p)
+                del self.plugins[i]
+                if hasattr(p, 'close'): p.close()
+        if removed: self.reset()
+        return removed
+
+    def reset(self, route=None):
+        # Drop the cached plugin chains of all routes (or of one route)
+        for r in self.routes if route is None else [route]:
+            r.reset()
+
+    def add_hook(self, name, func):
+        self._hooks[name].append(func)
+
+    def remove_hook(self, name, func):
+        if func in self._hooks[name]:
+            self._hooks[name].remove(func)
+            return True
+
+    def hook(self, name):
+        def decorator(func):
+            self.add_hook(name, func)
+            return func
+        return decorator
+
     def get(self, path=None, callback=None, **options):
         return self.route(path, 'GET', callback, **options)
 
     def post(self, path=None, callback=None, **options):
         return self.route(path, 'POST', callback, **options)
 
+    def get_url(self, routename, **kargs):
+        return self.router.build(routename, **kargs)
+
     def error(self, code=500, callback=None):
         def decorator(callback):
             self.error_handler[int(code)] = callback
@@ -326,36 +1145,219 @@ class Bottle:
         return decorator(callback) if callback else decorator
 
     def _handle(self, environ):
-        _local.request = Request(environ)
-        _local.response = Response()
+        route, args = self._begin(environ)
+        if route is None:
+            return args
+        if self.single_flight:
+            return self._call_shared(route, args)
+        return self._call(route, args)
+
+    def _begin(self, environ):
+        # Request setup shared by _handle() and _handle_async(). Returns
+        # (route, args), or (None, body) when no route could be called.
+        req = Request(environ)
+        _request_var.set(req)
+        _response_var.set(Response())
+        
+        try:
+            if Request.MAX_BODY_SIZE is not None: req._limit_body()
+            if self.metrics is None:
+                route, args = self.router.match(environ)
+            else:
+                route, args = self._match_timed(environ)
+        except HTTPResponse as e:
+            return None, self._cast(e)
+        except Exception as e:
+            return None, self._cast(self._handle_error(e))
+        req.route = route
+        return route, args
+
+    def _call_shared(self, route, args):
+        # Requests carrying credentials may get personal responses and
+        # conditional or range requests get answers that depend on their own
+        # headers; these are never coalesced. Only 200 responses and server
+        # errors without cookies, and varying on nothing but Accept-Encoding
+        # (handled later by compression), are shared; the rest is recomputed.
+        environ = request().environ
+        method = environ['REQUEST_METHOD'].upper()
+        if method not in ('GET', 'HEAD') or not _COALESCE_HEADERS.isdisjoint(environ):
+            return self._call(route, args)
+        key = (method, environ.get('HTTP_HOST', ''), environ.get('PATH_INFO', ''),
+               environ.get('QUERY_STRING', ''))
         
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        
+        if leader:
+            try:
+                out = self._call(route, args)
+                resp = response()
+                if (resp.status == 200 or resp.status >= 500) and isinstance(out, list) \
+                        and 'Set-Cookie' not in resp.headers and _vary_safe(resp.headers):
+                    flight.result = (resp.status, dict(resp.headers), out)
+                return out
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self._flights_lock:
+                    del self._flights[key]
+                flight.done.set()
+        
+        if not flight.done.wait(self.single_flight_timeout):
+            return self._cast(self._handle_error(HTTPError(503, 'Timed out waiting for a concurrent request.')))
+        if flight.error is not None:
+            return self._cast(self._handle_error(flight.error))
+        if flight.result is None:
+            return self._call(route, args)
+        status, headers, out = flight.result
+        resp = response()
+        resp.status = status
+        resp.headers.update(headers)
+        return list(out)
+
+    def _match_timed(self, environ):
+        clock = time.perf_counter
+        start = clock()
         try:
             route, args = self.router.match(environ)
-            out = route(**args)
+        except BaseException:
+            self.metrics.observe('match', '', clock() - start)
+            raise
+        self.metrics.observe('match', route.rule, clock() - start)
+        return route, args
+
+    def _call(self, route, args):
+        if self.metrics is not None:
+            return self._call_timed(route, args)
+        return self._cast(self._invoke(route, args))
+
+    def _call_timed(self, route, args):
+        start = time.perf_counter()
+        return self._cast_timed(route, start, self._invoke(route, args))
+
+    def _cast_timed(self, route, start, out):
+        mid = time.perf_counter()
+        out = self._cast(out)
+        self.metrics.observe('callback', route.rule, mid - start)
+        self.metrics.observe('cast', route.rule, time.perf_counter() - mid)
+        return out
+
+    def _invoke(self, route, args):
+        out = self._enter(route, args)
+        if isinstance(out, CoroutineType):
+            # async def callbacks also work on plain WSGI servers
+            try:
+                out = asyncio.run(out)
+            except HTTPResponse as e:
+                out = e
+            except Exception as e:
+                out = self._handle_error(e)
+        if self._hooks['after_request']:
+            out = self._after_request(out)
+        return out
+
+    async def _invoke_async(self, route, args):
+        out = self._enter(route, args)
+        if inspect.isawaitable(out):
+            try:
+                out = await out
+            except HTTPResponse as e:
+                out = e
+            except Exception as e:
+                out = self._handle_error(e)
+        if self._hooks['after_request']:
+            out = self._after_request(out)
+        return out
+
+    def _enter(self, route, args):
+        # Before-request hooks and the (plugin-wrapped) callback; the result
+        # may still be a coroutine that the caller has to run
+        try:
+            hooks = self._hooks['before_request']
+            if hooks:
+                for hook in hooks: hook()
+            return route.call(**args)
         except HTTPResponse as e:
-            out = e
-        except HTTPError as e:
-            handler = self.error_handler.get(e.status, self._default_error)
-            out = handler(e)
+            return e
         except Exception as e:
-            handler = self.error_handler.get(500, self._default_error)
-            out = handler(HTTPError(500, str(e)))
+            return self._handle_error(e)
+
+    def _after_request(self, out):
+        try:
+            for hook in self._hooks['after_request']: hook()
+        except HTTPResponse as e:
+            return e
+        except Exception as e:
+            return self._handle_error(e)
+        return out
+
+    async def _handle_async(self, environ, executor=None):
+        # Like _handle(), but awaits async def callbacks on the running loop
+        # and runs synchronous ones (including _cast) in `executor`.
+        route, args = self._begin(environ)
+        if route is None:
+            return args
+        
+        # Plugins may wrap an async def callback in a plain function that
+        # returns its coroutine, so look at the original callback
+        if not asyncio.iscoroutinefunction(route.callback):
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            call = self._call_shared if self.single_flight else self._call
+            return await loop.run_in_executor(executor, context.run, call, route, args)
         
-        return self._cast(out)
+        if self.metrics is None:
+            return self._cast(await self._invoke_async(route, args))
+        start = time.perf_counter()
+        return self._cast_timed(route, start, await self._invoke_async(route, args))
+
+    def _handle_error(self, e):
+        if not isinstance(e, HTTPError):
+            e = HTTPError(500, str(e))
+        resp = response()
+        resp.status = e.status
+        resp.headers.update(e.headers)
+        handler = self.error_handler.get(e.status, self._default_error)
+        return handler(e)
 
     def _cast(self, out):
-        resp = response()
+        resp = _response_var.get()
         
         if isinstance(out, HTTPResponse):
             resp.status = out.status
             resp.headers.update(out.headers)
             out = out.body
         
-        if out is None:
-            out = ''
+        if resp.status in (204, 304):
+            # No body (and therefore no entity headers) allowed
+            resp.headers.pop('Content-Type', None)
+            resp.headers.pop('Content-Length', None)
+            if hasattr(out, 'close'):
+                out.close()
+            return []
         
+        # Most common first: text, JSON data, empty bodies, lists of chunks
         if isinstance(out, str):
             out = out.encode('utf8')
+        elif isinstance(out, dict) and self.autojson:
+            return self._cast_json(resp, out)
+        elif isinstance(out, list) and self.autojson and not (
+                out and isinstance(out[0], bytes) and all(isinstance(x, bytes) for x in out)):
+            # Every list is JSON data, except a list of ready-made byte chunks
+            return self._cast_json(resp, out)
+        elif not out:
+            out = b''
+        elif isinstance(out, (tuple, list)) and isinstance(out[0], (bytes, str)):
+            try:
+                out = out[0][0:0].join(out)
+            except TypeError as e:
+                return self._cast(self._handle_error(e))
+            if isinstance(out, str):
+                out = out.encode('utf8')
         
         if isinstance(out, bytes):
             if 'Content-Type' not in resp.headers:
@@ -366,73 +1368,334 @@ class Bottle:
         if hasattr(out, 'read'):
             if 'Content-Type' not in resp.headers:
                 resp.headers['Content-Type'] = 'application/octet-stream'
+            # Let the server transmit files its own (possibly zero-copy) way
+            environ = request().environ
+            if 'wsgi.file_wrapper' in environ:
+                return environ['wsgi.file_wrapper'](out, WSGIFileWrapper.buffer_size)
+            elif hasattr(out, 'close') or not hasattr(out, '__iter__'):
+                return WSGIFileWrapper(out)
             return out
         
-        # Assume iterable
-        return out
+        # Iterables (e.g. generators or streamed templates) are passed on to
+        # the server chunk by chunk. Peek at the first chunk to pick defaults.
+        try:
+            iout = iter(out)
+            first = next(iout)
+            while not first:
+                first = next(iout)
+        except StopIteration:
+            return self._cast('')
+        except HTTPResponse as e:
+            first = e
+        except Exception as e:
+            first = self._handle_error(e)
+            return self._cast(first)
+        
+        if isinstance(first, HTTPResponse):
+            return self._cast(first)
+        elif isinstance(first, bytes):
+            new_iter = chain([first], iout)
+        elif isinstance(first, str):
+            new_iter = map(tob, chain([first], iout))
+        else:
+            return self._cast(self._handle_error(
+                HTTPError(500, 'Unsupported response type: %s' % type(first))))
+        if 'Content-Type' not in resp.headers:
+            resp.headers['Content-Type'] = 'text/html; charset=UTF-8'
+        if hasattr(out, 'close'):
+            new_iter = _closeiter(new_iter, out.close)
+        return new_iter
+
+    def _cast_json(self, resp, out):
+        if 'Content-Type' not in resp.headers:
+            resp.headers['Content-Type'] = 'application/json'
+        if isinstance(out, list) and len(out) > self.json_stream_items:
+            return self._iter_json(out)
+        try:
+            out = tob(self.json_dumps(out))
+        except Exception as e:
+            resp.headers.pop('Content-Type', None)
+            return self._cast(self._handle_error(e))
+        resp.headers['Content-Length'] = str(len(out))
+        return [out]
+
+    def _iter_json(self, items, batch=256):
+        dumps = self.json_dumps
+        yield b'['
+        for x in range(0, len(items), batch):
+            chunk = b','.join([tob(dumps(item)) for item in items[x:x + batch]])
+            yield b',' + chunk if x else chunk
+        yield b']'
 
     def _default_error(self, e):
         return '<h1>Error %s</h1><p>%s</p>' % (e.status, e.body)
 
-    def wsgi(self, environ, start_response):
-        out = self._cast(self._handle(environ))
-        resp = response()
+    def _compress(self, environ, resp, out):
+        headers = resp.headers
+        if resp.status in (204, 206, 304) or 'Content-Encoding' in headers:
+            return out
+        if not _compressible(headers.get('Content-Type', '')):
+            return out
+        # Files are sent as they are, keeping range support and sendfile()
+        wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(out, WSGIFileWrapper) or hasattr(out, 'read') \
+                or (isinstance(wrapper, type) and isinstance(out, wrapper)):
+            return out
+        vary = headers.get('Vary')
+        if not vary:
+            headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            headers['Vary'] = vary + ', Accept-Encoding'
+        if _accept_encoding(environ.get('HTTP_ACCEPT_ENCODING', '')).get('gzip', 0) <= 0:
+            return out
+        
+        if isinstance(out, list):
+            body = b''.join(out)
+            if len(body) < self.compress_min_size:
+                return out
+            body = gzip.compress(body, self.compress_level)
+            _set_gzip_headers(headers)
+            headers['Content-Length'] = str(len(body))
+            return [body]
         
-        status = '%d OK' % resp.status
-        headers = list(resp.headers.items())
+        length = headers.pop('Content-Length', None)
+        if length is not None and int(length) < self.compress_min_size:
+            headers['Content-Length'] = length
+            return out
+        _set_gzip_headers(headers)
+        return _closeiter(_iter_gzip(out, self.compress_level), getattr(out, 'close', None))
+
+    def _finish(self, environ, out):
+        resp = _response_var.get()
+        if self.compress:
+            out = self._compress(environ, resp, out)
         
+        if self.metrics is not None:
+            req = request()
+            route, method = req.route, req.method
+            if route is None or route.method == 'ANY':
+                # Clients may send any method token; keep the label set bounded
+                if method not in _METRICS_METHODS: method = 'OTHER'
+            self.metrics.record(method, route.rule if route else '', resp.status)
+        status = _HTTP_STATUS_LINES.get(resp.status) or '%d Unknown' % resp.status
+        return status, list(resp.headers.items()), out
+
+    def wsgi(self, environ, start_response):
+        status, headers, out = self._finish(environ, self._handle(environ))
         start_response(status, headers)
         return out
 
+    async def handle_async(self, environ, executor=None):
+        # Entry point for AsyncioServer: returns (status, headers, body)
+        return self._finish(environ, await self._handle_async(environ, executor))
+
     def __call__(self, environ, start_response):
         return self.wsgi(environ, start_response)
 
+# Response cache backend that keeps entries as files in one directory, so it
+# can be shared by the worker processes of a pre-fork server. Entries are
+# written to a temporary file and renamed into place. Files hold a JSON line
+# (key, expiry, status, headers) followed by the raw body, so nothing found in
+# the directory is ever executed; the directory itself must belong to this
+# user and must not be writable by anyone else.
+class FileCache:
+    def __init__(self, directory, ttl=None):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.stat(directory)
+        if (hasattr(os, 'getuid') and st.st_uid != os.getuid()) or st.st_mode & 0o022:
+            raise ValueError('Cache directory %r must be owned by this user and not '
+                             'writable by group or others.' % directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(tob(repr(key))).hexdigest())
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                stored_key, expires, status, headers = json.loads(fp.readline())
+                body = fp.read()
+        except (OSError, ValueError, TypeError):
+            return default
+        if stored_key != repr(key):
+            return default
+        if expires is not None and expires < time.time():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return default
+        return status, headers, body
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        status, headers, body = value
+        fd, tempname = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(json.dumps([repr(key), expires, status, headers]).encode('utf8') + b'\n')
+                fp.write(body)
+            os.replace(tempname, self._path(key))
+        except BaseException:
+            os.unlink(tempname)
+            raise
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+        return value
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+# Plugin that caches the encoded response of routes declared with a cache=
+# option, e.g. route('/news', cache=60) or cache={'ttl': 60, 'query': ['page'],
+# 'headers': ['Accept-Language']}. Entries are keyed by method, path and the
+# query string (or only the listed query parameters) plus listed headers.
+# A hit skips the callback and encoding, and If-None-Match is answered with 304.
+class ResponseCache:
+    name = 'cache'
+
+    def __init__(self, backend=None, ttl=60, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.backend = backend if backend is not None else LRUCache(
+            max_entries, maxbytes=max_bytes, sizeof=lambda entry: len(entry[2]) + 256)
+        self.ttl = ttl
+
+    def apply(self, callback, route):
+        config = route.config.get('cache')
+        if not config or route.method not in ('GET', 'HEAD', 'ANY'):
+            return callback
+        if not isinstance(config, dict):
+            config = {} if config is True else {'ttl': config}
+        ttl = config.get('ttl', self.ttl)
+        vary_query = config.get('query')
+        vary_headers = tuple(config.get('headers', ()))
+        backend, cast = self.backend, route.app._cast
+
+        def wrapper(**args):
+            req, resp = request(), response()
+            if req.method not in ('GET', 'HEAD'):
+                # ANY routes also serve unsafe methods, which are never cached
+                return callback(**args)
+            if vary_query is None:
+                query = req.environ.get('QUERY_STRING', '')
+            else:
+                query = tuple(tuple(req.query.getall(name)) for name in vary_query)
+            key = ('GET', req.path, query) + tuple(req.get_header(h) for h in vary_headers)
+            
+            entry = backend.get(key)
+            if entry is None:
+                out = callback(**args)
+                if not isinstance(out, (str, bytes, dict, list)):
+                    return out
+                data = cast(out)
+                if resp.status != 200 or not isinstance(data, list) or 'Set-Cookie' in resp.headers:
+                    return data
+                data = b''.join(data)
+                resp.headers['ETag'] = '"%s"' % hashlib.sha1(data).hexdigest()
+                if vary_headers:
+                    # Keep any Vary the callback set, adding our headers to it
+                    vary = [v.strip() for v in resp.headers.get('Vary', '').split(',') if v.strip()]
+                    known = {v.lower() for v in vary}
+                    vary.extend(h for h in vary_headers if h.lower() not in known)
+                    resp.headers['Vary'] = ', '.join(vary)
+                entry = (resp.status, dict(resp.headers), data)
+                backend.set(key, entry, ttl)
+            status, headers, data = entry
+            resp.status = status
+            resp.headers.update(headers)
+            if _etag_matches(req.get_header('If-None-Match') or '', headers['ETag']):
+                resp.status = 304
+                return ''
+            return data
+        return wrapper
+
 # Template system
+TEMPLATE_PATH = ['./', './views/']
+
+# Compiled templates keyed by (name or source, lookup path). Cached file
+# templates are only re-checked against their mtime if TEMPLATE_CHECK_MTIME is
+# set, so warm renders never touch the filesystem by default.
+TEMPLATES = LRUCache(100)
+TEMPLATE_CHECK_MTIME = False
+
 class SimpleTemplate:
+    stream_buffer = 256
+
     def __init__(self, source=None, name=None, lookup=None):
         self.source = source
         self.name = name
-        self.lookup = lookup or ['./', './views/']
+        self.lookup = lookup or TEMPLATE_PATH
+        self.filename = None
+        self.mtime = None
         if not source and name:
             self.load_template()
         self.prepare()
 
     def load_template(self):
         for path in self.lookup:
-            filepath = os.path.join(path, self.name)
-            if os.path.isfile(filepath):
-                with open(filepath, 'rb') as f:
-                    self.source = f.read().decode('utf8')
-                return
-            for ext in ['tpl', 'html']:
-                filepath = os.path.join(path, self.name + '.' + ext)
+            for filepath in [os.path.join(path, self.name)] + \
+                    [os.path.join(path, self.name + '.' + ext) for ext in ['tpl', 'html']]:
                 if os.path.isfile(filepath):
                     with open(filepath, 'rb') as f:
+                        self.mtime = os.fstat(f.fileno()).st_mtime
                         self.source = f.read().decode('utf8')
+                    self.filename = filepath
                     return
         raise ValueError('Template not found: %s' % self.name)
 
+    def is_stale(self):
+        if not self.filename:
+            return False
+        try:
+            return os.path.getmtime(self.filename) != self.mtime
+        except OSError:
+            return True
+
     def prepare(self):
         if not self.source:
             raise ValueError('No template source')
         self.code = self.translate(self.source)
+        self.co = self.compile(self.code)
 
     def translate(self, source):
+        # Emits exactly one line of Python per template line, so compiled
+        # line numbers point back into the template file.
         code = []
+        blocks = []
         indent = 0
         lines = source.splitlines(True)
         
         for line in lines:
             if line.strip().startswith('%'):
                 cmd = line.strip()[1:].strip()
-                if cmd.startswith('if') or cmd.startswith('for') or cmd.startswith('while') or cmd.startswith('def'):
-                    code.append('  ' * indent + cmd + ':')
+                keyword = re.match(r'\w*', cmd).group(0)
+                colon = '' if cmd.endswith(':') else ':'
+                if keyword in ('if', 'for', 'while', 'def'):
+                    code.append('  ' * indent + cmd + colon)
+                    blocks.append(keyword)
                     indent += 1
-                elif cmd.startswith('elif') or cmd.startswith('else'):
+                elif keyword in ('elif', 'else'):
                     indent = max(0, indent - 1)
-                    code.append('  ' * indent + cmd + ':')
+                    code.append('  ' * indent + cmd + colon)
                     indent += 1
                 elif cmd == 'end':
+                    block = blocks.pop() if blocks else None
+                    if block in ('for', 'while') and 'def' not in blocks:
+                        # Give render_iter() a chance to flush after each pass
+                        code.append('  ' * indent + 'if len(_stdout) >= _flush: yield')
+                    else:
+                        code.append('')
                     indent = max(0, indent - 1)
                 else:
                     code.append('  ' * indent + cmd)
@@ -441,7 +1704,7 @@ class SimpleTemplate:
                 pos = 0
                 for match in re.finditer(r'\{\{(.*?)\}\}', line):
                     parts.append(repr(line[pos:match.start()]))
-                    parts.append('str(' + match.group(1) + ')')
+                    parts.append('str(' + match.group(1).strip().lstrip('!') + ')')
                     pos = match.end()
                 parts.append(repr(line[pos:]))
                 code.append('  ' * indent + '_stdout.append(' + ' + '.join(parts) + ')')
@@ -450,19 +1713,64 @@ class SimpleTemplate:
         
         return '\n'.join(code)
 
+    def compile(self, code):
+        # Wrap the translated code in a function and compile it once. Names the
+        # template assigns are declared global, so they behave exactly like the
+        # template variables passed in as the function's globals.
+        filename = self.filename or '<template>'
+        body = ''.join('  ' + line + '\n' for line in code.split('\n'))
+        tree = ast.parse('def _render(_stdout, _flush):\n' + body + '  yield\n', filename)
+        ast.increment_lineno(tree, -1)
+        func = tree.body[0]
+        names = set()
+        for node in ast.walk(func):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                names.add(node.id)
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)) and node is not func:
+                names.add(node.name)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                names.update((a.asname or a.name).split('.')[0] for a in node.names)
+        names.discard('_stdout')
+        if names:
+            func.body.insert(0, ast.Global(sorted(names)))
+        ast.fix_missing_locations(tree)
+        namespace = {}
+        exec(compile(tree, filename, 'exec'), namespace)
+        return namespace['_render'].__code__
+
+    def execute(self, _stdout, flush, kwargs):
+        kwargs['__builtins__'] = builtins
+        return FunctionType(self.co, kwargs)(_stdout, flush)
+
     def render(self, **kwargs):
-        env = {'_stdout': []}
-        env.update(kwargs)
-        exec(self.code, env)
-        return ''.join(env['_stdout'])
-
-def template(tpl, **kwargs):
-    if '\n' in tpl or ('{{' in tpl and '}}' in tpl):
-        # Inline template
-        t = SimpleTemplate(source=tpl)
-    else:
-        # Template file
-        t = SimpleTemplate(name=tpl)
+        _stdout = []
+        for _ in self.execute(_stdout, sys.maxsize, kwargs):
+            pass
+        return ''.join(_stdout)
+
+    def render_iter(self, **kwargs):
+        # Yields the rendered output as utf8 encoded chunks while the template
+        # runs; a chunk is flushed at the end of a loop pass once at least
+        # `stream_buffer` pieces are pending.
+        _stdout = []
+        for _ in self.execute(_stdout, self.stream_buffer, kwargs):
+            if _stdout:
+                yield ''.join(_stdout).encode('utf8')
+                del _stdout[:]
+
+def template(tpl, template_lookup=None, template_stream=False, **kwargs):
+    inline = '\n' in tpl or ('{{' in tpl and '}}' in tpl)
+    lookup = None if inline else tuple(template_lookup or TEMPLATE_PATH)
+    tplid = (tpl, lookup)
+    t = TEMPLATES.get(tplid)
+    if t is None or (TEMPLATE_CHECK_MTIME and t.is_stale()):
+        if inline:
+            t = SimpleTemplate(source=tpl)
+        else:
+            t = SimpleTemplate(name=tpl, lookup=list(lookup))
+        TEMPLATES.set(tplid, t)
+    if template_stream:
+        return t.render_iter(**kwargs)
     return t.render(**kwargs)
 
 def view(tpl_name, **defaults):
@@ -478,7 +1786,82 @@ def view(tpl_name, **defaults):
     return decorator
 
 # Static file serving
-def static_file(filename, root, mimetype=True, download=False):
+def parse_date(ims):
+    try:
+        return email.utils.mktime_tz(email.utils.parsedate_tz(ims))
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def parse_range_header(header, maxlen=0):
+    # Yields (start, end) byte windows with an exclusive end
+    if not header or header[:6] != 'bytes=':
+        return
+    ranges = [r.split('-', 1) for r in header[6:].split(',') if '-' in r]
+    for start, end in ranges:
+        try:
+            start, end = start.strip(), end.strip()
+            if not start:  # bytes=-100 -> last 100 bytes
+                start, end = max(0, maxlen - int(end)), maxlen
+            elif not end:  # bytes=100- -> all but the first 100 bytes
+                start, end = int(start), maxlen
+            else:  # bytes=100-200 -> bytes 100-200 (inclusive)
+                start, end = int(start), min(int(end) + 1, maxlen)
+            if 0 <= start < end <= maxlen:
+                yield start, end
+        except ValueError:
+            pass
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in header.split(','))
+    return etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+# Read-limited view on a byte window of an open file. It keeps fileno() and
+# tell() so servers can still sendfile() just that window.
+class _RangeFile:
+    def __init__(self, fp, offset, length):
+        self.fp, self.end = fp, offset + length
+        self.fileno, self.close = fp.fileno, fp.close
+        self.seek(offset)
+
+    def seek(self, pos):
+        self.pos = self.fp.seek(pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        remaining = max(0, self.end - self.pos)
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self.fp.read(size)
+        self.pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _iter_multirange(fp, ranges, parts, buffer_size=64 * 1024):
+    try:
+        for (offset, end), head in zip(ranges, parts):
+            yield head
+            fp.seek(offset)
+            remaining = end - offset
+            while remaining > 0:
+                data = fp.read(min(buffer_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        yield parts[-1]
+    finally:
+        fp.close()
+
+def _static_meta(filename, root, mimetype, download):
     root = os.path.join(os.path.abspath(root), '')
     filename = os.path.abspath(os.path.join(root, filename.strip('/\\')))
     
@@ -500,27 +1883,603 @@ def static_file(filename, root, mimetype=True, download=False):
     stats = os.stat(filename)
     headers['Content-Length'] = str(stats.st_size)
     headers['Last-Modified'] = email.utils.formatdate(stats.st_mtime, usegmt=True)
+    headers['ETag'] = '"%x-%x"' % (stats.st_mtime_ns, stats.st_size)
+    headers['Accept-Ranges'] = 'bytes'
+    return filename, stats.st_size, stats.st_mtime, headers
+
+# Precompressed siblings (app.js.br, app.js.gz) in order of preference
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+def _accept_encoding(header):
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding.strip().lower()] = quality
+    return codings
+
+def _precompressed_meta(meta, encoding, suffix):
+    # Metadata of the `suffix` sibling of a file, or False if there is no
+    # such sibling or it is older than the file itself
+    filename, size, mtime, headers = meta
+    try:
+        stats = os.stat(filename + suffix)
+    except OSError:
+        return False
+    if not stat.S_ISREG(stats.st_mode) or stats.st_mtime < mtime:
+        return False
+    headers = headers.copy()
+    headers['Content-Encoding'] = encoding
+    headers['Content-Length'] = str(stats.st_size)
+    headers['ETag'] = '"%x-%x-%s"' % (stats.st_mtime_ns, stats.st_size, encoding)
+    return filename + suffix, stats.st_size, mtime, headers
+
+def static_file(filename, root, mimetype=True, download=False, cache=None,
+                precompressed=False):
+    # `cache` is an optional LRUCache for the resolved path, stat data and
+    # headers; cached entries are trusted until they expire or are evicted.
+    # With `precompressed`, a fresh .br/.gz sibling is served to clients that
+    # accept that content coding.
+    key = (filename, root, mimetype, download)
+    meta = cache.get(key) if cache is not None else None
+    if meta is None:
+        meta = _static_meta(filename, root, mimetype, download)
+        if cache is not None:
+            cache.set(key, meta)
+    
+    req = request()
+    environ = req.environ if req else {}
+    
+    accept = environ.get('HTTP_ACCEPT_ENCODING') if precompressed else None
+    if accept:
+        accepted = _accept_encoding(accept)
+        candidates = sorted((-accepted.get(encoding, 0), i, encoding, suffix)
+                            for i, (encoding, suffix) in enumerate(PRECOMPRESSED))
+        for quality, _, encoding, suffix in candidates:
+            if quality >= 0:
+                break
+            variant = cache.get(key + (encoding,)) if cache is not None else None
+            if variant is None:
+                variant = _precompressed_meta(meta, encoding, suffix)
+                if cache is not None:
+                    cache.set(key + (encoding,), variant)
+            if variant:
+                meta = variant
+                break
+    
+    filename, clen, mtime, headers = meta
+    headers = headers.copy()
+    if precompressed:
+        headers['Vary'] = 'Accept-Encoding'
+    
+    # Conditional requests; If-None-Match takes precedence over the date
+    if environ.get('REQUEST_METHOD', 'GET').upper() in ('GET', 'HEAD'):
+        inm = environ.get('HTTP_IF_NONE_MATCH')
+        ims = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if inm is not None:
+            not_modified = _etag_matches(inm, headers['ETag'])
+        elif ims is not None:
+            ims = parse_date(ims.split(';')[0].strip())
+            not_modified = ims is not None and ims >= int(mtime)
+        else:
+            not_modified = False
+        if not_modified:
+            return HTTPResponse(status=304, headers=headers)
     
-    return HTTPResponse(open(filename, 'rb'), headers=headers)
+    range_header = environ.get('HTTP_RANGE')
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range and if_range not in (headers['ETag'], headers['Last-Modified']):
+        range_header = None
+    try:
+        fp = open(filename, 'rb')
+    except OSError:
+        if cache is not None:
+            cache.pop(key)
+        raise HTTPError(404, "File does not exist.")
+    if not range_header:
+        return HTTPResponse(fp, headers=headers)
+    
+    ranges = list(parse_range_header(range_header, clen))
+    if not ranges:
+        fp.close()
+        raise HTTPError(416, "Requested Range Not Satisfiable",
+                        **{'Content-Range': 'bytes */%d' % clen})
+    
+    if len(ranges) == 1:
+        offset, end = ranges[0]
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (offset, end - 1, clen)
+        headers['Content-Length'] = str(end - offset)
+        return HTTPResponse(_RangeFile(fp, offset, end - offset),
+                            status=206, headers=headers)
+    
+    # Several ranges: stream a multipart/byteranges body
+    boundary = os.urandom(12).hex()
+    part_type = headers.pop('Content-Type', 'application/octet-stream')
+    parts = [tob('--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+                 % (boundary, part_type, offset, end - 1, clen))
+             for offset, end in ranges]
+    parts = [parts[0]] + [b'\r\n' + part for part in parts[1:]]
+    parts.append(tob('\r\n--%s--\r\n' % boundary))
+    headers['Content-Type'] = 'multipart/byteranges; boundary=%s' % boundary
+    headers['Content-Length'] = str(sum(map(len, parts)) +
+                                    sum(end - offset for offset, end in ranges))
+    body = _iter_multirange(fp, ranges, parts)
+    return HTTPResponse(body, status=206, headers=headers)
+
+# Serves files below `root` through static_file() with a metadata cache
+class StaticFiles:
+    def __init__(self, root, mimetype=True, download=False, cache_size=1024, cache_ttl=10,
+                 precompressed=False):
+        self.root = root
+        self.mimetype = mimetype
+        self.download = download
+        self.precompressed = precompressed
+        self.cache = LRUCache(cache_size, cache_ttl)
+
+    def __call__(self, filename):
+        return static_file(filename, self.root, self.mimetype, self.download,
+                           cache=self.cache, precompressed=self.precompressed)
 
 # Server
+class _ServerHandler(ServerHandler):
+    wsgi_file_wrapper = WSGIFileWrapper
+
+    def sendfile(self):
+        # Regular files go kernel-to-socket via socket.sendfile (os.sendfile),
+        # starting at the current file position and honouring Content-Length.
+        fp = self.result.fp
+        try:
+            fp.fileno()
+            offset = fp.tell()
+        except (AttributeError, OSError, ValueError):
+            return False
+        length = self.headers.get('Content-Length')
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        sock = self.request_handler.connection
+        self.bytes_sent += sock.sendfile(fp, offset, int(length) if length else None)
+        return True
+
+class _WSGIRequestHandler(WSGIRequestHandler):
+    def setup(self):
+        self.timeout = getattr(self.server, 'connection_timeout', None)
+        WSGIRequestHandler.setup(self)
+
+    def handle(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+            if len(self.raw_requestline) > 65536:
+                self.requestline = ''
+                self.request_version = ''
+                self.command = ''
+                self.send_error(414)
+                return
+            if not self.parse_request():
+                return
+            handler = _ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                                     multithread=getattr(self.server, 'multithread', False))
+            handler.request_handler = self
+            handler.run(self.server.get_app())
+        except socket.timeout as e:
+            self.log_error('Request timed out: %r', e)
+
+# WSGI server that hands accepted connections to a fixed pool of worker
+# threads. The queue between them is bounded, so a saturated pool stops the
+# accept loop and further clients wait in the listen backlog.
+class _ThreadPoolWSGIServer(WSGIServer):
+    multithread = True
+
+    def __init__(self, server_address, handler_class, pool_size=10, backlog=128,
+                 timeout=30, queue_size=None):
+        self.pool_size = pool_size
+        self.request_queue_size = backlog
+        self.connection_timeout = timeout
+        self._requests = queue.Queue(queue_size or pool_size * 2)
+        self._workers = []
+        WSGIServer.__init__(self, server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        # Workers start with the first request rather than in __init__, so a
+        # bound server can still be forked before it serves anything
+        if not self._workers:
+            for _ in range(self.pool_size):
+                worker = threading.Thread(target=self._work, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        self._requests.put((request, client_address))
+
+    def _work(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
 class WSGIRefServer:
+    name = 'wsgiref'
+
     def __init__(self, host='127.0.0.1', port=8080, **options):
         self.host = host
         self.port = port
         self.options = options
 
-    def run(self, app):
-        srv = make_server(self.host, self.port, app)
-        print("Bottle server starting up (using wsgiref)...")
-        print("Listening on http://%s:%d/" % (self.host, self.port))
+    def bind(self, app):
+        return make_server(self.host, self.port, app,
+                           handler_class=_WSGIRequestHandler)
+
+    def banner(self, srv):
+        print("Bottle server starting up (using %s)..." % self.name)
+        print("Listening on http://%s:%d/" % (self.host, srv.server_port))
         print("Hit Ctrl-C to quit.")
-        srv.serve_forever()
 
-def run(app=None, host='127.0.0.1', port=8080, server='wsgiref', quiet=False):
+    def run(self, app):
+        srv = self.bind(app)
+        self.banner(srv)
+        try:
+            srv.serve_forever()
+        finally:
+            srv.server_close()
+
+# Options: pool_size (worker threads), backlog (listen queue), timeout
+# (per-connection socket timeout in seconds) and queue_size (accepted
+# connections waiting for a worker, default 2 * pool_size)
+class ThreadPoolServer(WSGIRefServer):
+    name = 'threadpool'
+
+    def bind(self, app):
+        srv = _ThreadPoolWSGIServer((self.host, self.port), _WSGIRequestHandler, **self.options)
+        srv.set_app(app)
+        return srv
+
+# HTTP/1.1 server on asyncio streams with keep-alive. Bottle apps are called
+# through Bottle.handle_async(): async def callbacks run on the event loop,
+# everything else in a pool of `pool_size` threads. Other WSGI apps run in
+# that pool as a whole.
+class _AsyncioHTTPServer:
+    def __init__(self, app, host, port, backlog=1024, timeout=75, pool_size=32,
+                 max_header_size=65536):
+        self.app = app
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_header_size = max_header_size
+        self.socket = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(backlog)
+        self.server_address = self.socket.getsockname()
+        self.server_port = self.server_address[1]
+        self._loop = None
+        self._stopped = None
+        self._shutdown_request = False
+        self._done = threading.Event()
+
+    def serve_forever(self):
+        self._done.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._done.set()
+
+    def shutdown(self):
+        # Like socketserver: stops serve_forever() and waits for it to return
+        self._shutdown_request = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        self._done.wait()
+
+    def server_close(self):
+        self.socket.close()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._executor = ThreadPoolExecutor(self.pool_size)
+        server = await asyncio.start_server(self._connection, sock=self.socket,
+                                            limit=self.max_header_size)
+        try:
+            if not self._shutdown_request:
+                await self._stopped.wait()
+        finally:
+            server.close()
+            self._executor.shutdown(wait=False)
+            self._loop = None
+
+    async def _connection(self, reader, writer):
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.timeout)
+                except asyncio.LimitOverrunError:
+                    await self._error(writer, '431 Request Header Fields Too Large')
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                environ = self._environ(head, writer)
+                if environ is None:
+                    await self._error(writer, '400 Bad Request')
+                    break
+                if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+                    await self._error(writer, '411 Length Required')
+                    break
+                try:
+                    length = int(environ.get('CONTENT_LENGTH') or 0)
+                except ValueError:
+                    await self._error(writer, '400 Bad Request')
+                    break
+                if Request.MAX_BODY_SIZE is not None and length > Request.MAX_BODY_SIZE:
+                    await self._error(writer, '413 Payload Too Large')
+                    break
+                if length and environ.get('HTTP_EXPECT', '').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                try:
+                    body = await asyncio.wait_for(self._read_body(reader, length), self.timeout)
+                except asyncio.TimeoutError:
+                    break
+                environ['wsgi.input'] = body
+                
+                connection = environ.get('HTTP_CONNECTION', '').lower()
+                if environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+                    keep_alive = 'close' not in connection
+                else:
+                    keep_alive = 'keep-alive' in connection
+                
+                if hasattr(self.app, 'handle_async'):
+                    status, headers, out = await self.app.handle_async(environ, self._executor)
+                else:
+                    status, headers, out = await self._call_wsgi(environ)
+                keep_alive = await self._respond(writer, environ, status, headers, out, keep_alive)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    async def _read_body(self, reader, length):
+        if length <= Request.MEMFILE_MAX:
+            return BytesIO(await reader.readexactly(length) if length else b'')
+        body = tempfile.TemporaryFile()
+        try:
+            while length:
+                chunk = await reader.read(min(length, 65536))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b'', length)
+                body.write(chunk)
+                length -= len(chunk)
+        except BaseException:  # Also on cancellation by the read timeout
+            body.close()
+            raise
+        body.seek(0)
+        return body
+
+    def _environ(self, head, writer):
+        lines = head.decode('latin1').split('\r\n')
+        try:
+            method, target, protocol = lines[0].split(' ')
+        except ValueError:
+            return None
+        if not protocol.startswith('HTTP/1.'):
+            return None
+        path, _, query = target.partition('?')
+        host, port = self.server_address[:2]
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method.upper(),
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, 'latin1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': host,
+            'SERVER_PORT': str(port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': peer[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': WSGIFileWrapper,
+        }
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                return None
+            key = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+                if key in environ:
+                    value = environ[key] + ',' + value
+            environ[key] = value
+        return environ
+
+    async def _call_wsgi(self, environ):
+        response = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+        loop = asyncio.get_running_loop()
+        out = await loop.run_in_executor(self._executor, self.app, environ, start_response)
+        if not response:  # Generator apps call start_response lazily
+            out = chain([await loop.run_in_executor(self._executor, next, iter(out), b'')], out)
+        return response[0], list(response[1]), out
+
+    async def _error(self, writer, status):
+        writer.write(tob('HTTP/1.1 %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n' % status))
+        await writer.drain()
+
+    async def _respond(self, writer, environ, status, headers, out, keep_alive):
+        loop = asyncio.get_running_loop()
+        names = dict((name.lower(), value) for name, value in headers)
+        code = int(status[:3])
+        bodyless = environ['REQUEST_METHOD'] == 'HEAD' or code < 200 or code in (204, 304)
+        chunked = False
+        if 'content-length' not in names and not bodyless:
+            if environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+                chunked = True
+                headers.append(('Transfer-Encoding', 'chunked'))
+            else:
+                keep_alive = False
+        headers.append(('Date', email.utils.formatdate(usegmt=True)))
+        headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+        writer.write(tob('HTTP/1.1 %s\r\n%s\r\n' % (status, ''.join(
+            '%s: %s\r\n' % header for header in headers)), 'latin1'))
+        
+        try:
+            if bodyless:
+                pass
+            elif isinstance(out, list):
+                for data in out:
+                    writer.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+            elif isinstance(out, WSGIFileWrapper) and not chunked and hasattr(out, 'fileno'):
+                # Regular files: zero-copy transfer through loop.sendfile()
+                await writer.drain()
+                await loop.sendfile(writer.transport, out.fp, out.tell(), int(names['content-length']))
+            else:
+                # Any other iterable may block, so it is advanced in the pool
+                # within the context of the request it belongs to
+                context = contextvars.copy_context()
+                iout = iter(out)
+                while True:
+                    data = await loop.run_in_executor(self._executor, context.run, next, iout, None)
+                    if data is None:
+                        break
+                    if data:
+                        writer.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+                        await writer.drain()
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            if hasattr(out, 'close'):
+                out.close()
+        return keep_alive
+
+# Options: backlog, timeout (keep-alive idle timeout in seconds), pool_size
+# (threads for synchronous callbacks) and max_header_size
+class AsyncioServer(WSGIRefServer):
+    name = 'asyncio'
+
+    def bind(self, app):
+        return _AsyncioHTTPServer(app, self.host, self.port, **self.options)
+
+# Binds the listening socket once, then forks `workers` processes (default:
+# one per CPU) that each serve it with `worker_server`. The master restarts
+# workers that die and shuts them down gracefully on SIGTERM or SIGINT.
+class PreforkServer(WSGIRefServer):
+    name = 'prefork'
+
+    def __init__(self, host='127.0.0.1', port=8080, workers=None, worker_server='wsgiref', **options):
+        WSGIRefServer.__init__(self, host, port, **options)
+        self.workers = workers or os.cpu_count() or 1
+        self.worker_server = worker_server
+
+    def run(self, app):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('Pre-fork mode needs os.fork(), which this platform lacks.')
+        server = self.worker_server
+        if isinstance(server, str):
+            server = server_names[server]
+        srv = server(self.host, self.port, **self.options).bind(app)
+        self.name = 'prefork, %d x %s' % (self.workers, server.name)
+        self.banner(srv)
+        sys.stdout.flush()
+        
+        master = os.getpid()
+        children = set()
+        stopping = []
+        
+        def stop(signum, frame):
+            if os.getpid() != master:  # Forked, but no handlers of its own yet
+                os._exit(0)
+            stopping.append(signum)
+            for pid in list(children):
+                self._terminate(pid)
+        
+        handlers = [(signum, signal.signal(signum, stop)) for signum in (signal.SIGTERM, signal.SIGINT)]
+        try:
+            while True:
+                while not stopping and len(children) < self.workers:
+                    pid = self._spawn(srv)
+                    children.add(pid)
+                    # The signal may have arrived between fork() and add()
+                    if stopping: self._terminate(pid)
+                if not children:
+                    break
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                children.discard(pid)
+                if not stopping:
+                    print("Worker %d exited (status %d), restarting." % (pid, status))
+        finally:
+            for signum, handler in handlers:
+                signal.signal(signum, handler)
+            srv.server_close()
+
+    @staticmethod
+    def _terminate(pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:  # Already reaped, not yet discarded
+            pass
+
+    def _spawn(self, srv):
+        pid = os.fork()
+        if pid:
+            return pid
+        status = 0
+        try:
+            # Ctrl-C reaches the whole process group; only the master reacts
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda signum, frame:
+                          threading.Thread(target=srv.shutdown).start())
+            srv.serve_forever()
+            srv.server_close()
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+server_names = {
+    'wsgiref': WSGIRefServer,
+    'threadpool': ThreadPoolServer,
+    'prefork': PreforkServer,
+    'asyncio': AsyncioServer,
+}
+
+def run(app=None, host='127.0.0.1', port=8080, server='wsgiref', quiet=False, workers=None, **options):
     app = app or Bottle()
-    if server == 'wsgiref':
-        server = WSGIRefServer(host=host, port=port)
+    if workers:
+        server = PreforkServer(host=host, port=port, workers=workers, worker_server=server, **options)
+    elif isinstance(server, str):
+        server = server_names[server](host=host, port=port, **options)
     server.run(app)
 
 # Shortcuts
@@ -536,4 +2495,16 @@ def post(path=None, callback=None, **options):
     return app.post(path, callback, **options)
 
 def error(code=500, callback=None):
-    return app.error(code, callback)
\ No newline at end of file
+    return app.error(code, callback)
+
+def install(plugin):
+    return app.install(plugin)
+
+def uninstall(plugin):
+    return app.uninstall(plugin)
+
+def hook(name):
+    return app.hook(name)
+
+def url(routename, **kargs):
+    return app.get_url(routename, **kargs)
\ No newline at end of file
@@ -8,7 +8,7 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from bottle_minimal import route, run, template, request, response
+from bottle_minimal import route, run, template, request
 
 # 基础路由示例
 @route('/')
@@ -65,9 +65,8 @@ def submit():
 # JSON处理示例
 @route('/json')
 def json_example():
-    """JSON响应示例"""
-    response.set_header('Content-Type', 'application/json')
-    return '{"message": "Hello JSON!", "status": "success"}'
+    """JSON响应示例（dict会自动编码为JSON）"""
+    return {"message": "Hello JSON!", "status": "success"}
 
 @route('/api/data')
 def api_data():
@@ -79,9 +78,7 @@ def api_data():
         ],
         'total': 2
     }
-    response.set_header('Content-Type', 'application/json')
-    import json
-    return json.dumps(data)
+    return data
 
 # 错误处理示例
 @route('/error')
@@ -27,7 +27,6 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
@@ -38,7 +37,7 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     keywords='web framework wsgi bottle minimal lightweight',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[],  # 零依赖
     extras_require={
         'dev': [
@@ -7,15 +7,28 @@ Minimal Bottle 测试套件
 import sys
 import os
 import unittest
+import gzip
+import json
 import tempfile
 import shutil
+import socket
+import signal
+import subprocess
+import threading
+import asyncio
+import http.client
+from unittest import mock
+from io import BytesIO
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import bottle_minimal
 from bottle_minimal import (
     Bottle, Router, Request, Response, HTTPError, HTTPResponse,
-    route, get, post, template, static_file, html_escape, tob, touni
+    route, get, post, template, static_file, html_escape, tob, touni,
+    SimpleTemplate, WSGIRefServer, ThreadPoolServer, AsyncioServer, StaticFiles,
+    LRUCache
 )
 
 class TestHelpers(unittest.TestCase):
@@ -95,6 +108,105 @@ class TestRouter(unittest.TestCase):
             self.router.match(environ)
         self.assertEqual(cm.exception.status, 404)
 
+    def test_lazy_incremental_compile(self):
+        """测试动态路由延迟编译且只重建最后一个分组"""
+        for i in range(150):
+            self.router.add('/r%d/<x>' % i, 'GET', i)
+        self.assertNotIn('GET', self.router.dyna_regexes)
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/r149/a'}
+        self.assertEqual(self.router.match(environ), (149, {'x': 'a'}))
+        first_chunk = self.router.dyna_regexes['GET'][0]
+        for i in range(150, 250):
+            self.router.add('/r%d/<x>' % i, 'GET', i)
+        environ['PATH_INFO'] = '/r249/b'
+        self.assertEqual(self.router.match(environ), (249, {'x': 'b'}))
+        self.assertIs(self.router.dyna_regexes['GET'][0], first_chunk)
+        self.assertEqual(len(self.router.dyna_regexes['GET']), 3)
+
+    def test_match_cache(self):
+        """测试动态路由匹配结果缓存及其失效"""
+        router = Router(cache_size=2)
+        router.add('/item/<id:int>', 'GET', 'item')
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/item/42'}
+        self.assertEqual(router.match(environ), ('item', {'id': 42}))
+        target, args = router.match(environ)
+        self.assertEqual((target, args), ('item', {'id': 42}))
+        self.assertEqual((router.cache.hits, router.cache.misses), (1, 1))
+        args['id'] = 0
+        self.assertEqual(router.match(environ)[1], {'id': 42})
+        router.add('/item/<id:int>', 'GET', 'other')
+        self.assertEqual(len(router.cache), 0)
+        self.assertEqual(router.match(environ), ('item', {'id': 42}))
+        # 静态路由不经过缓存，也不计入命中/未命中
+        router.add('/about', 'GET', 'about')
+        router.match(environ)
+        stats = (router.cache.hits, router.cache.misses)
+        for _ in range(5):
+            self.assertEqual(router.match({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/about'}), ('about', {}))
+        self.assertEqual((router.cache.hits, router.cache.misses), stats)
+        router.add('/<x>/<y>', 'POST', 'post')
+        environ['PATH_INFO'] = '/item/x'
+        with self.assertRaises(HTTPError):
+            router.match(environ)
+
+    def test_method_not_allowed(self):
+        """测试405及Allow头、自动OPTIONS"""
+        self.router.add('/item/<id:int>', 'GET', 'get')
+        self.router.add('/item/<name>', 'DELETE', 'delete')
+        self.router.add('/form', 'POST', 'post')
+        environ = {'REQUEST_METHOD': 'PUT', 'PATH_INFO': '/item/5'}
+        with self.assertRaises(HTTPError) as cm:
+            self.router.match(environ)
+        self.assertEqual(cm.exception.status, 405)
+        self.assertEqual(cm.exception.headers['Allow'], 'DELETE, GET, HEAD, OPTIONS')
+        environ = {'REQUEST_METHOD': 'OPTIONS', 'PATH_INFO': '/form'}
+        with self.assertRaises(bottle_minimal.HTTPResponse) as cm:
+            self.router.match(environ)
+        self.assertEqual(cm.exception.status, 200)
+        self.assertEqual(cm.exception.headers['Allow'], 'OPTIONS, POST')
+        environ = {'REQUEST_METHOD': 'OPTIONS', 'PATH_INFO': '/missing'}
+        with self.assertRaises(HTTPError) as cm:
+            self.router.match(environ)
+        self.assertEqual(cm.exception.status, 404)
+
+    def test_build(self):
+        """测试反向路由生成URL"""
+        self.router.add('/', 'GET', None, name='index')
+        self.router.add('/blog/<year:int>/<slug>', 'GET', None, name='post')
+        self.router.add('/100%/<:re:[a-z]+>', 'GET', None, name='anon')
+        self.assertEqual(self.router.build('index'), '/')
+        self.assertEqual(self.router.build('index', page=2), '/?page=2')
+        self.assertEqual(self.router.build('post', year='2024', slug='hi'), '/blog/2024/hi')
+        self.assertEqual(self.router.build('/blog/<year:int>/<slug>', year=1, slug='a', q='x y'),
+                         '/blog/1/a?q=x+y')
+        self.assertEqual(self.router.build('anon', 'abc'), '/100%/abc')
+        with self.assertRaises(ValueError):
+            self.router.build('post', year=2024)
+        with self.assertRaises(ValueError):
+            self.router.build('missing')
+
+    def test_trie_router_matches_router(self):
+        """测试TrieRouter与Router的匹配结果一致"""
+        rules = ['/<name>', '/user/<name>', '/user/<id:int>/edit', '/user/admin/<page>',
+                 '/files/<path:path>', '/files/<name>.txt', '/price/<amount:float>',
+                 '/re/<code:re:[a-z]{2}\\d+>', '/blog/:year/:slug', '/a\\:b/<x>', '/api/v1/<x>/<y>']
+        paths = ['/home', '/user/bob', '/user/7/edit', '/user/x/edit', '/user/admin/settings',
+                 '/files/a/b/c.txt', '/files/c.txt', '/price/1.5', '/price/x', '/re/ab12', '/re/abc',
+                 '/blog/2024/hello', '/a:b/c', '/api/v1/x/y', '/api/v1/x', '/', '/nope/deeper/path']
+        routers = Router(), bottle_minimal.TrieRouter()
+        for router in routers:
+            for i, rule in enumerate(rules):
+                router.add(rule, 'GET', i)
+        for path in paths:
+            results = []
+            for router in routers:
+                environ = {'REQUEST_METHOD': 'HEAD', 'PATH_INFO': path}
+                try:
+                    results.append(router.match(environ))
+                except HTTPError as e:
+                    results.append(e.status)
+            self.assertEqual(results[0], results[1], path)
+
 class TestRequest(unittest.TestCase):
     """测试请求对象"""
     
@@ -121,7 +233,7 @@ class TestRequest(unittest.TestCase):
             'PATH_INFO': '/submit',
             'CONTENT_TYPE': 'application/x-www-form-urlencoded',
             'CONTENT_LENGTH': str(len(post_data)),
-            'wsgi.input': tempfile.BytesIO(post_data)
+            'wsgi.input': BytesIO(post_data)
         }
         request = Request(environ)
         
@@ -129,6 +241,148 @@ class TestRequest(unittest.TestCase):
         forms = request.forms
         self.assertEqual(forms, {'name': 'alice', 'city': 'london'})
     
+    def test_decoded_multi_values(self):
+        """测试查询参数解码、重复键与解析结果缓存"""
+        post_data = 'tag=c&note=caf%C3%A9'.encode()
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/submit',
+            'QUERY_STRING': 'q=hello+world&tag=a&tag=b%20c&flag',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(post_data)),
+            'wsgi.input': BytesIO(post_data)
+        }
+        request = Request(environ)
+        
+        self.assertEqual(request.query['q'], 'hello world')
+        self.assertEqual(request.query.getall('tag'), ['a', 'b c'])
+        self.assertEqual(request.query['flag'], '')
+        self.assertEqual(request.query.tag, 'b c')
+        self.assertEqual(request.query.missing, '')
+        self.assertEqual(request.forms['note'], 'café')
+        self.assertEqual(request.params['tag'], 'c')
+        self.assertEqual(request.params.getall('tag'), ['a', 'b c', 'c'])
+        self.assertIs(request.query, request.query)
+        self.assertIs(request.params, request.params)
+    
+    def test_streamed_body(self):
+        """测试按Content-Length流式读取请求体及大请求体写入临时文件"""
+        environ = {
+            'REQUEST_METHOD': 'PUT',
+            'PATH_INFO': '/upload',
+            'CONTENT_LENGTH': '10',
+            'wsgi.input': BytesIO(b'0123456789-trailing-bytes')
+        }
+        self.assertEqual(list(Request(environ).iter_body(4)), [b'0123', b'4567', b'89'])
+        
+        environ['wsgi.input'] = BytesIO(b'0123456789')
+        with mock.patch.object(Request, 'MEMFILE_MAX', 4):
+            body = Request(environ).body
+        self.assertNotIsInstance(body, BytesIO)
+        self.assertEqual(body.read(), b'0123456789')
+        body.close()
+        
+        environ['wsgi.input'] = BytesIO(b'012')
+        with self.assertRaises(HTTPError) as cm:
+            Request(environ).body
+        self.assertEqual(cm.exception.status, 400)
+        
+        del environ['CONTENT_LENGTH']
+        self.assertEqual(Request(environ).body.read(), b'')
+    
+    def test_body_size_limit(self):
+        """测试请求体超过MAX_BODY_SIZE时返回413"""
+        app = Bottle()
+        called = []
+        
+        @app.route('/upload', method='POST')
+        def upload():
+            called.append(True)
+            return 'ok'
+        
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/upload',
+            'CONTENT_LENGTH': '2048',
+            'wsgi.input': BytesIO(b'x' * 2048)
+        }
+        with mock.patch.object(Request, 'MAX_BODY_SIZE', 1024):
+            response_data = app._handle(environ)
+            self.assertEqual(bottle_minimal.response().status, 413)
+            self.assertEqual(called, [])
+            with self.assertRaises(HTTPError):
+                list(Request(environ).iter_body())
+        self.assertIn(b'Error 413', response_data[0])
+    
+    def _multipart_request(self, body, boundary='XyZ'):
+        return Request({
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/upload',
+            'CONTENT_TYPE': 'multipart/form-data; boundary=%s' % boundary,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body)
+        })
+    
+    def test_multipart_parser(self):
+        """测试multipart解析器在任意分块下的结果一致"""
+        body = (b'preamble\r\n--XyZ\r\nContent-Disposition: form-data; name="f"\r\n\r\nhello'
+                b'\r\n--XyZ\r\nContent-Disposition: form-data; name="up"; filename="a.txt"\r\n\r\n'
+                + b'\r\n--XY' * 50 + b'\r\n--XyZ--\r\n')
+        expected = [({'name': 'f'}, b'hello'), ({'name': 'up', 'filename': 'a.txt'}, b'\r\n--XY' * 50)]
+        for size in (1, 3, 7, 64, len(body)):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            parts = []
+            for headers, options, part, tempname in bottle_minimal._iter_multipart(chunks, b'XyZ', 100):
+                parts.append((options, part.read()))
+                part.close()
+                if tempname: os.unlink(tempname)
+            self.assertEqual(parts, expected)
+        with self.assertRaises(HTTPError) as cm:
+            list(bottle_minimal._iter_multipart([body[:-20]], b'XyZ', 1000))
+        self.assertEqual(cm.exception.status, 400)
+    
+    def test_file_upload(self):
+        """测试文件上传：表单字段、临时文件和save()"""
+        data = os.urandom(5000)
+        body = (b'--XyZ\r\nContent-Disposition: form-data; name="title"\r\n\r\ncaf\xc3\xa9'
+                b'\r\n--XyZ\r\nContent-Disposition: form-data; name="doc"; filename="../x/my report.pdf"'
+                b'\r\nContent-Type: application/pdf\r\n\r\n' + data + b'\r\n--XyZ--\r\n')
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        with mock.patch.object(Request, 'MEMFILE_MAX', 1024):
+            request = self._multipart_request(body)
+            self.assertEqual(request.forms['title'], 'café')
+            upload = request.files['doc']
+        self.assertEqual(upload.filename, 'my-report.pdf')
+        self.assertEqual(upload.content_type, 'application/pdf')
+        self.assertEqual(upload.content_length, 5000)
+        spooled = upload._tempname
+        self.assertTrue(os.path.exists(spooled))
+        upload.save(temp_dir)
+        self.assertFalse(os.path.exists(spooled))
+        with open(os.path.join(temp_dir, 'my-report.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        with self.assertRaises(IOError):
+            upload.save(temp_dir)
+        # 移动的临时文件和直接写入的小文件权限一致
+        small = os.path.join(temp_dir, 'small')
+        with open(small, 'wb'):
+            pass
+        self.assertEqual(os.stat(os.path.join(temp_dir, 'my-report.pdf')).st_mode & 0o777,
+                         os.stat(small).st_mode & 0o777)
+        # 移动后仍可再次保存
+        copy = BytesIO()
+        upload.save(copy)
+        self.assertEqual(copy.getvalue(), data)
+        upload.close()
+        self.assertTrue(os.path.exists(os.path.join(temp_dir, 'my-report.pdf')))
+        
+        with mock.patch.object(Request, 'MEMFILE_MAX', 1024):
+            request = self._multipart_request(body.replace(b'; filename="../x/my report.pdf"', b''))
+            with self.assertRaises(HTTPError) as cm:
+                request.forms
+        self.assertEqual(cm.exception.status, 413)
+    
     def test_header_access(self):
         """测试头部访问"""
         environ = {
@@ -201,6 +455,384 @@ class TestBottleApp(unittest.TestCase):
         # 应该返回错误页面
         self.assertIn(b'Error 500', response_data[0])
     
+    def test_method_not_allowed(self):
+        """测试405响应带有Allow头"""
+        @self.app.post('/submit')
+        def submit():
+            return 'ok'
+        
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/submit'}
+        response_data = self.app._handle(environ)
+        self.assertIn(b'Error 405', response_data[0])
+        self.assertEqual(bottle_minimal.response().status, 405)
+        self.assertEqual(bottle_minimal.response().headers['Allow'], 'OPTIONS, POST')
+        
+        environ = {'REQUEST_METHOD': 'OPTIONS', 'PATH_INFO': '/submit'}
+        self.assertEqual(self.app._handle(environ), [b''])
+        self.assertEqual(bottle_minimal.response().status, 200)
+    
+    def test_autojson(self):
+        """测试dict/list自动JSON编码、可替换的编码器和大列表流式编码"""
+        app = Bottle(json_dumps=lambda obj: json.dumps(obj, separators=(',', ':')).encode(),
+                     json_stream_items=3)
+        app.route('/dict', callback=lambda: {'a': [1, 2]})
+        app.route('/list', callback=lambda: [{'id': i} for i in range(2)])
+        app.route('/big', callback=lambda: list(range(600)))
+        app.route('/text', callback=lambda: ['a', 'b'])
+        app.route('/mixed', callback=lambda: ['a', 1])
+        app.route('/chunks', callback=lambda: [b'a', b'b'])
+        app.route('/tuple', callback=lambda: ('a', 1))
+        app.route('/empty', callback=lambda: [])
+        
+        def get(path):
+            out = app._handle({'REQUEST_METHOD': 'GET', 'PATH_INFO': path})
+            return b''.join(out), bottle_minimal.response().headers
+        
+        body, headers = get('/dict')
+        self.assertEqual(body, b'{"a":[1,2]}')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(headers['Content-Length'], '11')
+        self.assertEqual(get('/list')[0], b'[{"id":0},{"id":1}]')
+        self.assertEqual(get('/empty'), (b'[]', {'Content-Type': 'application/json',
+                                                  'Content-Length': '2'}))
+        body, headers = get('/big')
+        self.assertEqual(json.loads(body), list(range(600)))
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(get('/text')[0], b'["a","b"]')
+        self.assertEqual(get('/mixed')[0], b'["a",1]')
+        self.assertEqual(get('/chunks'), (b'ab', {'Content-Type': 'text/html; charset=UTF-8',
+                                                  'Content-Length': '2'}))
+        get('/tuple')
+        self.assertEqual(bottle_minimal.response().status, 500)
+    
+    def test_request_json(self):
+        """测试request().json的解析、缓存和错误处理"""
+        app = Bottle()
+        
+        @app.route('/echo', method='POST')
+        def echo():
+            data = bottle_minimal.request().json
+            return {'same': data is bottle_minimal.request().json, 'data': data}
+        
+        def post(body, content_type='application/json'):
+            out = app._handle({'REQUEST_METHOD': 'POST', 'PATH_INFO': '/echo',
+                               'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body)),
+                               'wsgi.input': BytesIO(body)})
+            return bottle_minimal.response().status, b''.join(out)
+        
+        self.assertEqual(post(b'{"x": [1]}'), (200, b'{"same": true, "data": {"x": [1]}}'))
+        self.assertEqual(post(b'{"x": 1}', 'text/plain'), (200, b'{"same": true, "data": null}'))
+        self.assertEqual(post(b'{broken')[0], 400)
+        with mock.patch.object(Request, 'MEMFILE_MAX', 4):
+            self.assertEqual(post(b'{"x": 1}')[0], 413)
+    
+    def test_status_line(self):
+        """测试WSGI状态行带有正确的原因短语"""
+        self.app.route('/created', callback=lambda: HTTPResponse('ok', status=201))
+        statuses = []
+        for path in ('/missing', '/created'):
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+            self.app(environ, lambda status, headers: statuses.append(status))
+        self.assertEqual(statuses, ['404 Not Found', '201 Created'])
+        self.assertFalse(hasattr(Request({}), '__dict__'))
+        self.assertFalse(hasattr(Response(), '__dict__'))
+    
+    def test_plugins(self):
+        """测试插件：只在首次调用时包装、apply/skip和卸载后重建"""
+        applied = []
+        
+        class Prefix:
+            name = 'prefix'
+            def __init__(self, text): self.text = text
+            def apply(self, callback, route):
+                applied.append(route.rule)
+                return lambda **args: self.text + callback(**args)
+        
+        def exclaim(callback):
+            return lambda **args: callback(**args) + '!'
+        
+        self.app.route('/a', callback=lambda: 'a', apply=[exclaim])
+        self.app.route('/b/<x>', callback=lambda x: x, skip=['prefix'], tag='raw')
+        self.app.install(Prefix('>'))
+        
+        def get(path):
+            return self.app._handle({'REQUEST_METHOD': 'GET', 'PATH_INFO': path})
+        
+        self.assertEqual(get('/a'), [b'>a!'])
+        self.assertEqual(get('/a'), [b'>a!'])
+        self.assertEqual(get('/b/y'), [b'y'])
+        self.assertEqual(applied, ['/a'])
+        self.assertEqual(self.app.routes[1].config, {'tag': 'raw'})
+        
+        self.app.install(Prefix('#'))
+        self.assertEqual(get('/a'), [b'#a!'])
+        self.assertEqual(len(self.app.uninstall('prefix')), 2)
+        self.assertEqual(get('/a'), [b'a!'])
+        self.assertEqual(applied, ['/a', '/a'])
+    
+    def test_hooks(self):
+        """测试before_request/after_request钩子"""
+        calls = []
+        self.app.route('/x', callback=lambda: calls.append('route') or 'x')
+        self.app.route('/fail', callback=lambda: 1 / 0)
+        
+        @self.app.hook('before_request')
+        def before():
+            calls.append('before')
+        
+        @self.app.hook('after_request')
+        def after():
+            calls.append('after')
+            bottle_minimal.response().set_header('X-After', '1')
+        
+        self.assertEqual(self.app._handle({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/x'}), [b'x'])
+        self.assertEqual(calls, ['before', 'route', 'after'])
+        self.app._handle({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/fail'})
+        self.assertEqual(bottle_minimal.response().status, 500)
+        self.assertEqual(bottle_minimal.response().headers['X-After'], '1')
+        self.assertTrue(self.app.remove_hook('before_request', before))
+    
+    def test_response_cache(self):
+        """测试响应缓存插件：跳过回调、vary键、ETag/304和文件后端"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        for backend in (None, bottle_minimal.FileCache(temp_dir)):
+            app = Bottle()
+            app.install(bottle_minimal.ResponseCache(backend))
+            calls = []
+            
+            @app.route('/news', cache={'ttl': 60, 'query': ['page'], 'headers': ['Accept-Language']})
+            def news():
+                calls.append(1)
+                return {'page': bottle_minimal.request().query.get('page')}
+            
+            app.route('/live', callback=lambda: calls.append(0) or 'live')
+            
+            @app.route('/vary', cache={'headers': ['Accept-Language', 'Accept']})
+            def vary():
+                bottle_minimal.response().headers['Vary'] = 'accept, Origin'
+                return 'vary'
+            
+            def get(path, query='', **headers):
+                environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query}
+                environ.update(('HTTP_' + k.upper(), v) for k, v in headers.items())
+                out = app._handle(environ)
+                return bottle_minimal.response().status, b''.join(out)
+            
+            self.assertEqual(get('/news', 'page=1&utm=x'), (200, b'{"page": "1"}'))
+            self.assertEqual(get('/news', 'page=1&utm=y'), (200, b'{"page": "1"}'))
+            self.assertEqual(len(calls), 1)
+            etag = bottle_minimal.response().headers['ETag']
+            self.assertEqual(bottle_minimal.response().headers['Content-Type'], 'application/json')
+            self.assertEqual(get('/news', 'page=1', if_none_match=etag), (304, b''))
+            get('/news', 'page=2')
+            get('/news', 'page=1', accept_language='de')
+            self.assertEqual(len(calls), 3)
+            get('/live')
+            get('/live')
+            self.assertEqual(calls.count(0), 2)
+            get('/vary')
+            self.assertEqual(bottle_minimal.response().headers['Vary'], 'accept, Origin, Accept-Language')
+            
+            # ANY路由上的POST等方法不缓存
+            app.route('/any', method='ANY', cache=60,
+                      callback=lambda: calls.append(bottle_minimal.request().method) or 'any')
+            for method in ('POST', 'POST', 'GET', 'GET'):
+                environ = {'REQUEST_METHOD': method, 'PATH_INFO': '/any', 'QUERY_STRING': ''}
+                self.assertEqual(app._handle(environ), [b'any'])
+            self.assertEqual(calls.count('POST'), 2)
+            self.assertEqual(calls.count('GET'), 1)
+        
+        # 文件后端不反序列化可执行的格式，损坏的条目视为未命中；拒绝他人可写的目录
+        cache = bottle_minimal.FileCache(temp_dir)
+        cache.set(('GET', '/x', ''), (200, {'ETag': '"1"'}, b'body\n'))
+        self.assertEqual(cache.get(('GET', '/x', '')), (200, {'ETag': '"1"'}, b'body\n'))
+        with open(cache._path(('GET', '/y', '')), 'wb') as f:
+            f.write(b'\x80\x04garbage')
+        self.assertIsNone(cache.get(('GET', '/y', '')))
+        os.chmod(temp_dir, 0o777)
+        with self.assertRaises(ValueError):
+            bottle_minimal.FileCache(temp_dir)
+    
+    def test_single_flight(self):
+        """测试并发的相同GET请求只计算一次，并共享结果、错误和超时"""
+        app = Bottle(single_flight=True, single_flight_timeout=5)
+        release = threading.Event()
+        calls = []
+        
+        @app.route('/slow/<name>')
+        def slow(name):
+            calls.append(name)
+            release.wait(5)
+            if name == 'fail':
+                raise ValueError('boom')
+            return 'result %s' % name
+        
+        def get(path, results, **extra):
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': ''}
+            environ.update(extra)
+            out = app._handle(environ)
+            results.append((bottle_minimal.response().status, b''.join(out)))
+        
+        for name, expected in (('a', (200, b'result a')), ('fail', None)):
+            results = []
+            threads = [threading.Thread(target=get, args=('/slow/' + name, results)) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            while name not in calls:
+                threading.Event().wait(0.01)
+            threading.Event().wait(0.3)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+            release.clear()
+            self.assertEqual(calls.count(name), 1)
+            self.assertEqual(len(set(results)), 1)
+            self.assertEqual(results[0][0], 500 if expected is None else 200)
+            if expected:
+                self.assertEqual(results[0], expected)
+        
+        # 带Cookie的请求不合并；等待超时返回503
+        app.single_flight_timeout = 0.05
+        results = []
+        leader = threading.Thread(target=get, args=('/slow/b', results))
+        leader.start()
+        while 'b' not in calls:
+            threading.Event().wait(0.01)
+        get('/slow/b', results)
+        self.assertEqual(results, [(503, results[0][1])])
+        release.set()
+        get('/slow/b', results, HTTP_COOKIE='id=1')
+        leader.join(5)
+        self.assertEqual(calls.count('b'), 2)
+        
+        # 条件请求(304)的结果不会共享给普通请求
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        with open(os.path.join(temp_dir, 'a.txt'), 'wb') as f:
+            f.write(b'content')
+        release.clear()
+        
+        @app.route('/file')
+        def file():
+            calls.append('file')
+            release.wait(5)
+            return static_file('a.txt', temp_dir)
+        
+        release.set()
+        get('/file', [])
+        etag = bottle_minimal.response().headers['ETag']
+        release.clear()
+        app.single_flight_timeout = 5
+        results = []
+        leader = threading.Thread(target=get, args=('/file', results), kwargs={'HTTP_IF_NONE_MATCH': etag})
+        leader.start()
+        while calls.count('file') < 2:
+            threading.Event().wait(0.01)
+        follower = threading.Thread(target=get, args=('/file', results))
+        follower.start()
+        threading.Event().wait(0.2)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(sorted(results), [(200, b'content'), (304, b'')])
+        self.assertEqual(calls.count('file'), 3)
+        
+        # 不同Host分开计算；带Vary（Accept-Encoding除外）的结果不共享
+        @app.route('/header/<name>')
+        def header(name):
+            calls.append(name)
+            release.wait(5)
+            if name == 'lang':
+                bottle_minimal.response().headers['Vary'] = 'Accept-Language'
+            return bottle_minimal.request().get_header('Accept-Language' if name == 'lang' else 'Host')
+        
+        for name, key in (('lang', 'HTTP_ACCEPT_LANGUAGE'), ('host', 'HTTP_HOST')):
+            release.clear()
+            results = []
+            leader = threading.Thread(target=get, args=('/header/' + name, results), kwargs={key: 'a'})
+            leader.start()
+            while name not in calls:
+                threading.Event().wait(0.01)
+            follower = threading.Thread(target=get, args=('/header/' + name, results), kwargs={key: 'b'})
+            follower.start()
+            threading.Event().wait(0.2)
+            release.set()
+            leader.join(5)
+            follower.join(5)
+            self.assertEqual(sorted(results), [(200, b'a'), (200, b'b')])
+            self.assertEqual(calls.count(name), 2)
+    
+    def test_metrics(self):
+        """测试按路由统计请求数、状态码和各阶段耗时，以及Prometheus输出"""
+        self.assertIsNone(self.app.metrics)
+        app = Bottle(metrics=True)
+        app.route('/item/<id:int>', callback=lambda id: {'id': id})
+        
+        @app.route('/async')
+        async def handler():
+            return 'async'
+        
+        app.route('/metrics', callback=app.metrics.endpoint)
+        
+        def get(path):
+            return app({'REQUEST_METHOD': 'GET', 'PATH_INFO': path}, lambda status, headers: None)
+        
+        threads = [threading.Thread(target=get, args=('/item/%d' % i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        get('/missing')
+        for method in ('FOO', 'BAR', 'POST'):
+            app({'REQUEST_METHOD': method, 'PATH_INFO': '/missing'}, lambda status, headers: None)
+        asyncio.run(app.handle_async({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/async'}))
+        
+        snap = app.metrics.snapshot()
+        self.assertEqual(snap['requests'][('GET', '/item/<id:int>')], 4)
+        self.assertEqual(snap['statuses'][('/item/<id:int>', 200)], 4)
+        self.assertEqual(snap['statuses'][('', 404)], 4)
+        self.assertEqual(snap['requests'][('OTHER', '')], 2)
+        self.assertEqual(snap['requests'][('POST', '')], 1)
+        self.assertNotIn(('FOO', ''), snap['requests'])
+        self.assertEqual(snap['statuses'][('/async', 200)], 1)
+        for phase in ('match', 'callback', 'cast'):
+            hist = snap['latency'][(phase, '/item/<id:int>')]
+            self.assertEqual(hist['count'], 4)
+            self.assertEqual(hist['buckets'][-1], (float('inf'), 4))
+        self.assertEqual(snap['latency'][('callback', '/async')]['count'], 1)
+        
+        text = b''.join(get('/metrics')).decode()
+        self.assertIn('bottle_requests_total{method="GET",rule="/item/<id:int>"} 4', text)
+        self.assertIn('bottle_responses_total{rule="",status="404"} 4', text)
+        self.assertIn('bottle_requests_total{method="OTHER",rule=""} 2', text)
+        self.assertIn('bottle_phase_seconds_count{phase="cast",rule="/item/<id:int>"} 4', text)
+    
+    def test_lru_cache_maxbytes(self):
+        """测试LRUCache按字节数限制容量"""
+        cache = LRUCache(100, maxbytes=10)
+        cache.set('a', b'12345')
+        cache.set('b', b'12345')
+        cache.set('c', b'1')
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.size, 6)
+        cache.set('b', b'1')
+        self.assertEqual(cache.size, 2)
+    
+    def test_streamed_response(self):
+        """测试生成器与流式模板响应"""
+        @self.app.route('/stream')
+        def stream():
+            return template('% for i in items:\n{{i}},\n% end\n', template_stream=True, items=range(3))
+        
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/stream'}
+        response_data = self.app._handle(environ)
+        self.assertNotIsInstance(response_data, list)
+        self.assertEqual(b''.join(response_data), b'0,\n1,\n2,\n')
+        headers = bottle_minimal.response().headers
+        self.assertEqual(headers['Content-Type'], 'text/html; charset=UTF-8')
+        self.assertNotIn('Content-Length', headers)
+
     def test_custom_error_handler(self):
         """测试自定义错误处理"""
         @self.app.error(404)
@@ -211,6 +843,74 @@ class TestBottleApp(unittest.TestCase):
         response_data = self.app._handle(environ)
         self.assertEqual(response_data, [b'Custom 404 - Page not found'])
 
+class TestCompression(unittest.TestCase):
+    """测试动态响应压缩"""
+    
+    def setUp(self):
+        self.app = Bottle(compress=True, compress_min_size=100)
+        self.app.route('/big', callback=lambda: 'x' * 1000)
+        self.app.route('/small', callback=lambda: 'small')
+        self.app.route('/stream', callback=lambda: ('line %d\n' % i for i in range(100)))
+        
+        @self.app.route('/png')
+        def png():
+            bottle_minimal.response().set_header('Content-Type', 'image/png')
+            return b'\x89PNG' * 100
+    
+    def _call(self, path, accept='gzip'):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'HTTP_ACCEPT_ENCODING': accept}
+        result = {}
+        def start_response(status, headers):
+            result.update(headers)
+        body = b''.join(self.app(environ, start_response))
+        return result, body
+    
+    def test_compress_body(self):
+        """测试压缩大响应并修正响应头"""
+        headers, body = self._call('/big')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+        self.assertEqual(gzip.decompress(body), b'x' * 1000)
+    
+    def test_compress_stream(self):
+        """测试流式压缩可迭代响应"""
+        headers, body = self._call('/stream')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(gzip.decompress(body), ''.join('line %d\n' % i for i in range(100)).encode())
+    
+    def test_compress_skipped(self):
+        """测试小响应、已压缩类型和不支持gzip的客户端不压缩"""
+        for path, accept in (('/small', 'gzip'), ('/png', 'gzip'), ('/big', 'gzip;q=0'), ('/big', '')):
+            headers, body = self._call(path, accept)
+            self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, b'x' * 1000)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+    
+    def test_compress_headers(self):
+        """测试压缩后ETag变为弱校验、去掉Accept-Ranges，文件响应不压缩"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        with open(os.path.join(temp_dir, 'site.css'), 'w') as f:
+            f.write('body { color: red; }\n' * 100)
+        self.app.route('/site.css', callback=lambda: static_file('site.css', temp_dir))
+        
+        @self.app.route('/tagged')
+        def tagged():
+            bottle_minimal.response().headers.update({'ETag': '"abc"', 'Accept-Ranges': 'bytes'})
+            return 'x' * 1000
+        
+        headers, body = self._call('/tagged')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['ETag'], 'W/"abc"')
+        self.assertNotIn('Accept-Ranges', headers)
+        headers, body = self._call('/site.css')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        self.assertFalse(headers['ETag'].startswith('W/'))
+        self.assertEqual(body, b'body { color: red; }\n' * 100)
+
 class TestTemplate(unittest.TestCase):
     """测试模板系统"""
     
@@ -246,6 +946,51 @@ class TestTemplate(unittest.TestCase):
         result = template(tpl, user=None)
         self.assertIn('Hello Guest!', result)
 
+    def test_template_compiled_once(self):
+        """测试模板只编译一次，且错误行号对应模板行"""
+        tpl = SimpleTemplate(source='line1\n% total = 0\n% for i in items:\n% total = total + i\n% end\n{{total}} {{1 / 0 if fail else ""}}\n')
+        self.assertEqual(tpl.render(items=[1, 2], fail=False), 'line1\n3 \n')
+        self.assertEqual(tpl.render(items=[5], fail=False), 'line1\n5 \n')
+        try:
+            tpl.render(items=[], fail=True)
+            self.fail('ZeroDivisionError not raised')
+        except ZeroDivisionError as e:
+            tb = e.__traceback__
+        while tb.tb_next:
+            tb = tb.tb_next
+        self.assertEqual(tb.tb_frame.f_code.co_filename, '<template>')
+        self.assertEqual(tb.tb_lineno, 6)
+
+    def test_template_render_iter(self):
+        """测试流式渲染模板"""
+        tpl = SimpleTemplate(source='<table>\n% for row in rows:\n<tr>{{row}}</tr>\n% end\n</table>\n')
+        tpl.stream_buffer = 10
+        chunks = list(tpl.render_iter(rows=range(100)))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(isinstance(c, bytes) for c in chunks))
+        self.assertEqual(b''.join(chunks).decode('utf8'), tpl.render(rows=range(100)))
+
+    def test_template_cache(self):
+        """测试模板缓存与mtime检查"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.addCleanup(setattr, bottle_minimal, 'TEMPLATE_CHECK_MTIME', False)
+        filename = os.path.join(temp_dir, 'cached.tpl')
+        with open(filename, 'w') as f:
+            f.write('v1 {{x}}')
+        
+        self.assertEqual(template('cached', template_lookup=[temp_dir], x=1), 'v1 1')
+        cached = bottle_minimal.TEMPLATES.get(('cached', (temp_dir,)))
+        self.assertIsNotNone(cached)
+        
+        with open(filename, 'w') as f:
+            f.write('v2 {{x}}')
+        os.utime(filename, (cached.mtime + 10, cached.mtime + 10))
+        # 默认不检查文件，继续使用缓存
+        self.assertEqual(template('cached', template_lookup=[temp_dir], x=2), 'v1 2')
+        bottle_minimal.TEMPLATE_CHECK_MTIME = True
+        self.assertEqual(template('cached', template_lookup=[temp_dir], x=3), 'v2 3')
+
 class TestStaticFile(unittest.TestCase):
     """测试静态文件服务"""
     
@@ -278,6 +1023,324 @@ class TestStaticFile(unittest.TestCase):
             static_file('nonexistent.txt', root=self.temp_dir)
         self.assertEqual(cm.exception.status, 404)
 
+    def _get(self, path='/test.txt', **headers):
+        app = Bottle()
+        app.route('/<filename:path>', callback=lambda filename: static_file(filename, root=self.temp_dir))
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+        environ.update(('HTTP_' + k.upper(), v) for k, v in headers.items())
+        body = b''.join(app._handle(environ))
+        return bottle_minimal.response(), body
+    
+    def test_static_file_conditional(self):
+        """测试ETag与If-Modified-Since返回304"""
+        resp, body = self._get()
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body, b'Test content')
+        etag = resp.headers['ETag']
+        
+        resp, body = self._get(if_none_match=etag)
+        self.assertEqual((resp.status, body), (304, b''))
+        self.assertEqual(resp.headers['ETag'], etag)
+        self.assertNotIn('Content-Length', resp.headers)
+        
+        resp, body = self._get(if_modified_since=resp.headers['Last-Modified'])
+        self.assertEqual(resp.status, 304)
+        resp, body = self._get(if_none_match='"other"', if_modified_since=resp.headers['Last-Modified'])
+        self.assertEqual(resp.status, 200)
+    
+    def test_static_file_range(self):
+        """测试单个和多个Range请求"""
+        resp, body = self._get(range='bytes=5-')
+        self.assertEqual((resp.status, body), (206, b'content'))
+        self.assertEqual(resp.headers['Content-Range'], 'bytes 5-11/12')
+        self.assertEqual(resp.headers['Content-Length'], '7')
+        
+        resp, body = self._get(range='bytes=0-3,-4')
+        self.assertEqual(resp.status, 206)
+        self.assertTrue(resp.headers['Content-Type'].startswith('multipart/byteranges'))
+        self.assertEqual(int(resp.headers['Content-Length']), len(body))
+        self.assertIn(b'Content-Range: bytes 0-3/12\r\n\r\nTest\r\n', body)
+        self.assertIn(b'Content-Range: bytes 8-11/12\r\n\r\ntent\r\n', body)
+        
+        resp, body = self._get(range='bytes=100-200')
+        self.assertEqual(resp.status, 416)
+        self.assertEqual(resp.headers['Content-Range'], 'bytes */12')
+        
+        resp, body = self._get(range='bytes=0-3', if_range='"stale"')
+        self.assertEqual((resp.status, body), (200, b'Test content'))
+
+    def test_static_files_cache(self):
+        """测试StaticFiles元数据缓存"""
+        assets = StaticFiles(self.temp_dir, cache_size=2, cache_ttl=60)
+        first = assets('test.txt')
+        first.body.close()
+        with mock.patch('os.stat') as stat, mock.patch('mimetypes.guess_type') as guess:
+            second = assets('test.txt')
+            second.body.close()
+        self.assertFalse(stat.called or guess.called)
+        self.assertEqual(first.headers, second.headers)
+        
+        # 文件被删除后缓存项失效
+        os.remove(self.test_file)
+        with self.assertRaises(HTTPError) as cm:
+            assets('test.txt')
+        self.assertEqual(cm.exception.status, 404)
+        self.assertEqual(len(assets.cache), 0)
+    
+    def test_static_file_precompressed(self):
+        """测试预压缩文件协商"""
+        with open(self.test_file + '.gz', 'wb') as f:
+            f.write(gzip.compress(b'Test content'))
+        with open(self.test_file + '.br', 'wb') as f:
+            f.write(b'fake brotli')
+        
+        bottle_minimal._request_var.set(Request({'HTTP_ACCEPT_ENCODING': 'gzip, deflate'}))
+        resp = static_file('test.txt', root=self.temp_dir, precompressed=True)
+        self.assertEqual(gzip.decompress(resp.body.read()), b'Test content')
+        resp.body.close()
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Content-Type'], 'text/plain')
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(resp.headers['Content-Length'], str(os.path.getsize(self.test_file + '.gz')))
+        
+        bottle_minimal._request_var.set(Request({'HTTP_ACCEPT_ENCODING': 'gzip;q=0.5, br'}))
+        resp = static_file('test.txt', root=self.temp_dir, precompressed=True)
+        resp.body.close()
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        
+        # 比原文件旧的预压缩文件不会被使用
+        os.utime(self.test_file + '.br', (0, 0))
+        bottle_minimal._request_var.set(Request({'HTTP_ACCEPT_ENCODING': 'br'}))
+        resp = static_file('test.txt', root=self.temp_dir, precompressed=True)
+        resp.body.close()
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+
+    def test_lru_cache_ttl(self):
+        """测试LRU缓存的容量与过期"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('d', 4, ttl=-1)
+        self.assertIsNone(cache.get('d'))
+
+    def test_static_file_sendfile(self):
+        """测试内置服务器通过sendfile发送静态文件"""
+        data = os.urandom(300 * 1024)
+        with open(os.path.join(self.temp_dir, 'big.bin'), 'wb') as f:
+            f.write(data)
+        app = Bottle()
+        app.route('/<filename:path>', callback=lambda filename: static_file(filename, root=self.temp_dir))
+        
+        srv = WSGIRefServer(port=0).bind(app)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        self.addCleanup(srv.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(srv.shutdown)
+        
+        with mock.patch.object(socket.socket, 'sendfile', autospec=True,
+                               side_effect=socket.socket.sendfile) as sendfile:
+            conn = http.client.HTTPConnection('127.0.0.1', srv.server_port)
+            conn.request('GET', '/big.bin')
+            resp = conn.getresponse()
+            body = resp.read()
+            conn.close()
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(body, data)
+            
+            conn = http.client.HTTPConnection('127.0.0.1', srv.server_port)
+            conn.request('GET', '/big.bin', headers={'Range': 'bytes=1000-1999'})
+            resp = conn.getresponse()
+            body = resp.read()
+            conn.close()
+            self.assertEqual(resp.status, 206)
+            self.assertEqual(body, data[1000:2000])
+        self.assertEqual(sendfile.call_count, 2)
+
+class TestServer(unittest.TestCase):
+    """测试服务器适配器"""
+    
+    def _serve(self, server, app):
+        srv = server.bind(app)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        self.addCleanup(srv.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(srv.shutdown)
+        return srv.server_port
+    
+    def _fetch(self, port, path):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        conn.request('GET', path)
+        resp = conn.getresponse()
+        body = resp.read()
+        conn.close()
+        return resp.status, body
+    
+    def test_threadpool_server(self):
+        """测试线程池服务器并发处理请求"""
+        app = Bottle()
+        barrier = threading.Barrier(2, timeout=5)
+        
+        @app.route('/wait')
+        def wait():
+            # 两个请求必须同时在处理中才能通过
+            barrier.wait()
+            return 'ok %s' % bottle_minimal.request().environ['wsgi.multithread']
+        
+        port = self._serve(ThreadPoolServer(port=0, pool_size=2, timeout=5), app)
+        results = []
+        clients = [threading.Thread(target=lambda: results.append(self._fetch(port, '/wait')))
+                   for _ in range(2)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        self.assertEqual(results, [(200, b'ok True')] * 2)
+
+    def test_asyncio_server(self):
+        """测试asyncio服务器：async路由、同步路由、keep-alive和流式响应"""
+        app = Bottle()
+        events = {}
+        
+        @app.route('/wait/<key>')
+        async def wait(key):
+            # 在事件循环中等待另一个请求把事件置位
+            events.setdefault(key, asyncio.Event())
+            await events[key].wait()
+            return 'woken %s' % bottle_minimal.request().path
+        
+        @app.route('/wake/<key>')
+        async def wake(key):
+            events.setdefault(key, asyncio.Event()).set()
+            return 'ok'
+        
+        @app.route('/sync')
+        def sync():
+            return 'sync %s' % (threading.current_thread() is not threading.main_thread())
+        
+        app.route('/stream', callback=lambda: ('%d,' % i for i in range(5)))
+        
+        port = self._serve(AsyncioServer(port=0, timeout=5), app)
+        waiter = []
+        thread = threading.Thread(target=lambda: waiter.append(self._fetch(port, '/wait/a')))
+        thread.start()
+        self.assertEqual(self._fetch(port, '/wake/a'), (200, b'ok'))
+        thread.join(5)
+        self.assertEqual(waiter, [(200, b'woken /wait/a')])
+        
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        self.addCleanup(conn.close)
+        for path, body in (('/sync', b'sync True'), ('/stream', b'0,1,2,3,4,'), ('/missing', None)):
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            data = resp.read()
+            if body is None:
+                self.assertEqual(resp.status, 404)
+            else:
+                self.assertEqual((resp.status, data), (200, body))
+        self.assertEqual(resp.getheader('Connection'), 'keep-alive')
+    
+    def test_asyncio_server_sendfile(self):
+        """测试asyncio服务器发送静态文件和Range请求"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        data = os.urandom(200 * 1024)
+        with open(os.path.join(temp_dir, 'big.bin'), 'wb') as f:
+            f.write(data)
+        app = Bottle()
+        app.route('/<filename:path>', callback=lambda filename: static_file(filename, root=temp_dir))
+        port = self._serve(AsyncioServer(port=0), app)
+        
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        self.addCleanup(conn.close)
+        conn.request('GET', '/big.bin')
+        self.assertEqual(conn.getresponse().read(), data)
+        conn.request('GET', '/big.bin', headers={'Range': 'bytes=100-199'})
+        resp = conn.getresponse()
+        self.assertEqual((resp.status, resp.read()), (206, data[100:200]))
+    
+    def test_asyncio_server_upload(self):
+        """测试asyncio服务器接收大请求体及413"""
+        app = Bottle()
+        
+        @app.route('/upload', method='POST')
+        def upload():
+            body = bottle_minimal.request().body
+            return '%s %d' % (isinstance(body, BytesIO), len(body.read()))
+        
+        port = self._serve(AsyncioServer(port=0), app)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        self.addCleanup(conn.close)
+        conn.request('POST', '/upload', body=b'x' * 300000)
+        self.assertEqual(conn.getresponse().read(), b'False 300000')
+        with mock.patch.object(Request, 'MAX_BODY_SIZE', 1024):
+            conn.request('POST', '/upload', body=b'x' * 2048)
+            self.assertEqual(conn.getresponse().status, 413)
+        
+        # 请求体发送中断的连接在超时后关闭
+        port = self._serve(AsyncioServer(port=0, timeout=0.2), app)
+        sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.addCleanup(sock.close)
+        sock.sendall(b'POST /upload HTTP/1.1\r\nHost: x\r\nContent-Length: 100\r\n\r\nxxxxxxxxxx')
+        self.assertEqual(sock.recv(1024), b'')
+    
+    def test_async_callback_on_wsgi(self):
+        """测试普通WSGI调用中的async路由"""
+        app = Bottle()
+        
+        @app.route('/async')
+        async def handler():
+            await asyncio.sleep(0)
+            return 'async result'
+        
+        self.assertEqual(app._handle({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/async'}), [b'async result'])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+    def test_prefork_server(self):
+        """测试多进程预派生服务器：共享端口、重启worker、SIGTERM退出"""
+        script = (
+            'import os, sys\n'
+            'sys.path.insert(0, %r)\n'
+            'from bottle_minimal import Bottle, run\n'
+            'app = Bottle()\n'
+            'app.route("/pid", callback=lambda: str(os.getpid()))\n'
+            'run(app, port=0, workers=2)\n'
+        ) % os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        proc = subprocess.Popen([sys.executable, '-u', '-c', script],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.addCleanup(proc.stdout.close)
+        self.addCleanup(proc.wait, 10)
+        self.addCleanup(proc.kill)
+        for line in proc.stdout:
+            if line.startswith(b'Listening on'):
+                port = int(line.rsplit(b':', 1)[1].strip(b'/\n'))
+                break
+        
+        def worker_pids():
+            pids = set()
+            for _ in range(50):
+                status, body = self._fetch(port, '/pid')
+                self.assertEqual(status, 200)
+                pids.add(int(body))
+                if len(pids) == 2:
+                    break
+            return pids
+        
+        pids = worker_pids()
+        self.assertNotIn(proc.pid, pids)
+        os.kill(pids.pop(), signal.SIGKILL)
+        # 被杀死的worker会被重启，服务不中断
+        self.assertEqual(self._fetch(port, '/pid')[0], 200)
+        
+        proc.send_signal(signal.SIGTERM)
+        self.assertEqual(proc.wait(10), 0)
+
 class TestIntegration(unittest.TestCase):
     """集成测试"""
     
@@ -298,10 +1361,10 @@ class TestIntegration(unittest.TestCase):
         
         def start_response(status, headers):
             self.assertEqual(status, '200 OK')
-            self.assertIn(('Content-Type', 'text/html; charset=UTF-8'), headers)
+            self.assertIn(('Content-Type', 'application/json'), headers)
         
         response_data = app(environ, start_response)
-        self.assertIn(b'API test successful', response_data[0])
+        self.assertEqual(json.loads(response_data[0]), {'message': 'API test successful', 'status': 'ok'})
 
 if __name__ == '__main__':
     # 运行所有测试